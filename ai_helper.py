@@ -1,10 +1,16 @@
 import os
 import json
+import time
 import logging
 from datetime import datetime, timedelta
-from extensions import openai_client
-from cache_helper import cache_data, get_cached_data
-from models import Document, StudyPlan
+from llm_gateway import llm_gateway
+from cache_helper import get_or_compute, digest, data_version, user_tag
+from semantic_cache import semantic_cache, context_fingerprint
+from models import StudyPlan
+
+# Maximum prompt tokens spent on retrieved context in tutor mode
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 1500))
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get('CONTEXT_CACHE_TTL_SECONDS', 86400))
 
 def generate_study_schedule(topic, priority, daily_time, completion_date, difficulty, goals, documents=None, link=None):
     """Generate an optimized study plan based on user preferences and optional documents"""
@@ -99,11 +105,12 @@ Requirements:
             messages[1]["content"] += f"\nUse this additional context:\n{context}"
 
         logging.info("Generating study plan with OpenAI")
-        response = openai_client.chat.completions.create(
+        response = llm_gateway.chat_completion(
             model="gpt-4",
             messages=messages,
             temperature=0.7,
-            max_tokens=2000
+            max_tokens=2000,
+            timeout=180
         )
 
         logging.debug(f"OpenAI response: {response.choices[0].message.content}")
@@ -137,76 +144,125 @@ Requirements:
         logging.error(f"Study plan generation error: {str(e)}")
         raise
 
-def get_relevant_context(query, user_id=1):
-    """Retrieve relevant context from user's documents and study plans"""
-    cache_key = f"context_{user_id}_{hash(query)}"
-    cached_context = get_cached_data(cache_key)
-    if cached_context:
-        return cached_context
-
-    context_data = []
-    # Get relevant documents
-    documents = Document.query.filter_by(user_id=user_id, processed=True).all()
-    study_plans = StudyPlan.query.filter_by(user_id=user_id).all()
-
-    # Extract content from documents
-    for doc in documents:
-        if doc.structured_content:
-            content = json.loads(doc.structured_content)
+def get_relevant_context(query, user_id=1, max_tokens=CONTEXT_TOKEN_BUDGET, top_k=8):
+    """Retrieve the chunks of the user's documents and study plans most relevant to the query"""
+    # The data version moves on every index write, so entries can live long without going stale
+    cache_key = f"context:{user_id}:v{data_version(user_id)}:{digest(query, max_tokens, top_k)}"
+
+    def build_context():
+        import vector_index
+
+        # Keep the best-scoring chunks that fit in the prompt token budget
+        context_data = []
+        used_tokens = 0
+        for chunk in vector_index.search(user_id, query, top_k=top_k):
+            if used_tokens + chunk['tokens'] > max_tokens:
+                continue
+            used_tokens += chunk['tokens']
             context_data.append({
-                'type': 'document',
-                'title': content.get('title', doc.original_filename),
-                'content': content.get('summary', '')
+                'type': chunk['type'],
+                'title': chunk['title'],
+                'content': chunk['text']
             })
+        return context_data or None  # Don't cache an empty result
+
+    # Concurrent misses share one search
+    return get_or_compute(cache_key, build_context, CONTEXT_CACHE_TTL_SECONDS, tags=[user_tag(user_id)]) or []
+
+def _build_chat_messages(message, context=None, tutor_mode=False):
+    """Assemble the message list shared by the blocking and streaming chat paths"""
+    messages = [
+        {
+            "role": "system",
+            "content": "You are a helpful study assistant. "
+            + ("As a tutor, reference relevant materials from the user's documents and provide detailed explanations. "
+               if tutor_mode else "Provide clear, concise answers to help students understand concepts better.")
+        }
+    ]
 
-    # Extract content from study plans
-    for plan in study_plans:
-        if plan.content:
-            content = json.loads(plan.content)
-            context_data.append({
-                'type': 'study_plan',
-                'title': plan.title,
-                'content': content.get('summary', '')
-            })
+    # Add context if provided
+    if context and (tutor_mode or "document" in message.lower() or "uploaded" in message.lower()):
+        messages.append({
+            "role": "system",
+            "content": context
+        })
 
-    if context_data:
-        cache_data(cache_key, context_data, 3600)  # Cache for 1 hour
-    return context_data
+    messages.append({"role": "user", "content": message})
+    return messages
 
 def chat_response(message, context=None, tutor_mode=False, user_id=1):
     """Generate chat responses with optional tutor mode using document context"""
     try:
-        messages = [
-            {
-                "role": "system",
-                "content": "You are a helpful study assistant. "
-                + ("As a tutor, reference relevant materials from the user's documents and provide detailed explanations. "
-                   if tutor_mode else "Provide clear, concise answers to help students understand concepts better.")
-            }
-        ]
-
-        # Add context if provided
-        if context and (tutor_mode or "document" in message.lower() or "uploaded" in message.lower()):
-            messages.append({
-                "role": "system",
-                "content": context
-            })
-
-        messages.append({"role": "user", "content": message})
+        messages = _build_chat_messages(message, context, tutor_mode)
 
         # Enhanced logging for debugging
         logging.debug(f"Sending chat request with tutor_mode={tutor_mode}")
         logging.debug(f"Context available: {bool(context)}")
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4",  # Using standard gpt-4 model
-            messages=messages
-        )
-        return response.choices[0].message.content
+        def generate():
+            response = llm_gateway.chat_completion(
+                model="gpt-4",  # Using standard gpt-4 model
+                messages=messages,
+                hedge=True  # Latency-critical: race a backup request if the first is slow
+            )
+            return response.choices[0].message.content
+
+        # Near-identical questions with the same system prompt and context share answers
+        fingerprint = context_fingerprint(messages[:-1])
+        cached_answer, embedding = semantic_cache.lookup(message, fingerprint, regenerate_fn=generate)
+        if cached_answer:
+            return cached_answer
+
+        started = time.monotonic()
+        answer = generate()
+        semantic_cache.store(embedding, message, fingerprint, answer, time.monotonic() - started)
+        return answer
     except Exception as e:
         logging.error(f"Failed to generate chat response: {e}")
         raise Exception(f"Failed to generate chat response: {e}")
 
+def stream_chat_completion(messages, model="gpt-4"):
+    """Yield content tokens from a streamed chat completion as they arrive"""
+    stream = llm_gateway.stream_chat_completion(
+        model=model,
+        messages=messages
+    )
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        token = chunk.choices[0].delta.content
+        if token:
+            yield token
+
+def stream_chat_response(message, context=None, tutor_mode=False, user_id=1):
+    """Stream chat response tokens with optional tutor mode using document context"""
+    try:
+        messages = _build_chat_messages(message, context, tutor_mode)
+
+        logging.debug(f"Streaming chat request with tutor_mode={tutor_mode}")
+        logging.debug(f"Context available: {bool(context)}")
+
+        def regenerate():
+            # Sampled false-hit checks run in the background, so a plain completion will do
+            response = llm_gateway.chat_completion(model="gpt-4", messages=messages)
+            return response.choices[0].message.content
+
+        fingerprint = context_fingerprint(messages[:-1])
+        cached_answer, embedding = semantic_cache.lookup(message, fingerprint, regenerate_fn=regenerate)
+        if cached_answer:
+            yield cached_answer
+            return
+
+        started = time.monotonic()
+        answer_parts = []
+        for token in stream_chat_completion(messages):
+            answer_parts.append(token)
+            yield token
+        semantic_cache.store(embedding, message, fingerprint, ''.join(answer_parts), time.monotonic() - started)
+    except Exception as e:
+        logging.error(f"Failed to stream chat response: {e}")
+        raise Exception(f"Failed to stream chat response: {e}")
+
 def update_study_plan(plan_id, updates):
     """Update study plan schedule with AI optimization"""
     try:
@@ -218,7 +274,7 @@ def update_study_plan(plan_id, updates):
         if not current_schedule:
             return False
 
-        response = openai_client.chat.completions.create(
+        response = llm_gateway.chat_completion(
             model="gpt-4",
             messages=[
                 {
@@ -244,4 +300,145 @@ def update_study_plan(plan_id, updates):
 
     except Exception as e:
         logging.error(f"Failed to update study plan: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def generate_answer_feedback(question, answer, answer_type, attempt_number, speech_metrics=None):
+    """Grade an interview answer; returns a dict with score and feedback"""
+    delivery = ""
+    if speech_metrics:
+        # Measured locally from word timings; given as context so feedback can comment on delivery
+        delivery = f"""
+Measured Delivery (spoken answer):
+- Pace: {speech_metrics['words_per_minute']} words per minute (pace variation {speech_metrics['pace_variation']})
+- Pauses: {speech_metrics['pause_count']} over 0.5s, {speech_metrics['long_pause_count']} over 2s, {speech_metrics['pause_ratio']:.0%} of speaking time
+- Filler words: {speech_metrics['filler_count']} ({speech_metrics['filler_rate']} per 100 words)
+- Delivery confidence score: {speech_metrics['confidence_score']}/100
+"""
+
+    feedback_prompt = f"""As an expert interview assessor, analyze this interview answer:
+
+Question: {question.question}
+Expected Answer: {question.sample_answer}
+User's Answer: {answer}
+Category: {question.category}
+Attempt Number: {attempt_number}
+{delivery}
+You MUST format your response as a valid JSON object with exactly these fields:
+{{
+    "score": (a number between 0 and 100),
+    "feedback": "detailed analysis of the answer"
+}}
+
+Respond ONLY with the JSON object, no additional text."""
+
+    response = llm_gateway.chat_completion(
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": "You are an expert interview assessor. You must return only valid JSON."},
+            {"role": "user", "content": feedback_prompt}
+        ],
+        temperature=0.3  # Lower temperature for more consistent formatting
+    )
+
+    feedback_data = response.choices[0].message.content
+    logging.debug(f"Raw feedback response: {feedback_data}")
+    try:
+        feedback_dict = json.loads(feedback_data.strip())
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid feedback format from AI: {e}")
+
+    # Validate response format
+    required_fields = ['score', 'feedback']
+    if not all(k in feedback_dict for k in required_fields):
+        raise ValueError(f"Missing required fields. Got: {list(feedback_dict.keys())}")
+
+    # Validate and normalize scores
+    feedback_dict['score'] = max(0, min(100, float(feedback_dict['score'])))
+    return feedback_dict
+
+def analyze_ats_compatibility(resume, job_description):
+    """ATS-style compatibility analysis of a resume against a job description; None if it fails"""
+    compatibility_prompt = f"""As an ATS (Applicant Tracking System) expert, analyze the compatibility between this resume and job description:
+
+Resume:
+{resume[:1000]}
+
+Job Description:
+{job_description[:500]}
+
+Provide a detailed ATS analysis in this exact JSON format:
+{{
+    "compatibility_score": (overall match percentage between 0-100),
+    "ats_score": (ATS readability score between 0-100),
+    "keyword_match_rate": (percentage of key terms matched between 0-100),
+    "strengths": [list of 3-5 key matching strengths with specific examples],
+    "gaps": [list of 2-3 missing skills or experiences],
+    "key_matches": [list of 4-5 important keywords found in both],
+    "missing_keywords": [list of 3-4 important keywords from job description not found in resume],
+    "format_suggestions": [list of 2-3 ATS-friendly formatting suggestions if any]
+}}"""
+
+    try:
+        response = llm_gateway.chat_completion(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": "You are an expert ATS analyst specializing in technical roles."},
+                {"role": "user", "content": compatibility_prompt}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.7
+        )
+        compatibility = json.loads(response.choices[0].message.content)
+        logging.info("Generated ATS compatibility analysis")
+        return compatibility
+    except Exception as e:
+        # The questions are still useful without the analysis
+        logging.error(f"Error generating compatibility analysis: {str(e)}")
+        return None
+
+def generate_interview_questions(job_description, count=5):
+    """Generate interview questions for a job description as [{'question', 'category', 'difficulty'}]"""
+    questions_prompt = f"""Generate {count} interview questions based on this job description:
+
+{job_description[:500]}
+
+For each question, use this EXACT format with no variations:
+
+Question: [The interview question]
+Category: [Technical/Behavioral]
+Difficulty: [Easy/Medium/Hard]
+
+Generate exactly {count} questions."""
+
+    response = llm_gateway.chat_completion(
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": "You are an expert interviewer generating questions."},
+            {"role": "user", "content": questions_prompt}
+        ],
+        temperature=0.7,
+        max_tokens=2000
+    )
+    content = response.choices[0].message.content
+    logging.debug(f"Received interview questions: {content}")
+
+    # Parse questions
+    questions = []
+    current_question = {}
+    for line in content.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('Question:'):
+            if current_question:
+                questions.append(current_question)
+            current_question = {'question': line[9:].strip()}
+        elif line.startswith('Category:'):
+            current_question['category'] = line[9:].strip()
+        elif line.startswith('Difficulty:'):
+            current_question['difficulty'] = line[11:].strip()
+            questions.append(current_question)
+            current_question = {}
+
+    return [q for q in questions if all(k in q for k in ['question', 'category', 'difficulty'])]
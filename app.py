@@ -1,8 +1,12 @@
 import os
 import logging
-from flask import Flask, request, jsonify, render_template, flash, redirect, url_for
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, render_template, flash, redirect, url_for, stream_with_context
 from werkzeug.utils import secure_filename
-from extensions import app, db, openai_client  # Import the shared client
+from sqlalchemy import delete, insert
+from pagination import keyset_page, request_page, page_response
+from extensions import app, db
+from llm_gateway import llm_gateway  # All OpenAI calls go through the gateway
 from auth import auth as auth_blueprint
 from flask_login import login_required, current_user
 from subscription import subscription as subscription_blueprint, premium_required
@@ -42,6 +46,48 @@ def from_json_filter(value):
         logger.error(f"JSON parsing error: {str(e)}") # Updated logger
         return None
 
+def sse_event(data, event=None):
+    """Format a JSON payload as a Server-Sent Events message"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+def stream_chat_reply(token_stream, user_id, question, study_plan_id=None):
+    """Forward chat tokens over SSE and save the ChatHistory row once the stream ends"""
+    def generate():
+        from models import ChatHistory
+        # Flush headers right away so the client sees the stream open
+        yield ": stream-open\n\n"
+
+        answer_parts = []
+        try:
+            for token in token_stream:
+                answer_parts.append(token)
+                yield sse_event({'token': token})
+
+            answer = ''.join(answer_parts)
+            chat_record = ChatHistory(
+                user_id=user_id,
+                question=question,
+                answer=answer,
+                study_plan_id=study_plan_id)
+            db.session.add(chat_record)
+            db.session.commit()
+
+            yield sse_event({'success': True, 'response': answer}, event='done')
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
+            db.session.rollback()
+            yield sse_event({'error': 'Failed to generate response', 'details': str(e)}, event='error')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 # Update index route to include study plans
 @app.route('/')
 def index():
@@ -94,20 +140,44 @@ def study_plan():
     try:
         from models import StudyPlan, Folder
 
-        # Get all study plans for the user
-        study_plans = StudyPlan.query.filter_by(user_id=current_user.id).order_by(StudyPlan.created_at.desc()).all()
-        logger.info(f"Found {len(study_plans)} study plans for user {current_user.id}") # Updated logger
+        # First page of the user's study plans; the rest scroll in from /study-plan/page
+        study_plans, next_cursor = keyset_page(StudyPlan.query.filter_by(user_id=current_user.id), StudyPlan)
 
         # Get all folders for the user
         folders = Folder.query.filter_by(user_id=current_user.id).all()
 
-        return render_template('study_plan.html', plans=study_plans, folders=folders)
+        return render_template('study_plan.html', plans=study_plans, folders=folders, next_cursor=next_cursor)
 
     except Exception as e:
         logger.error(f"Error loading study plans: {str(e)}") # Updated logger
         flash('Error loading study plans.', 'error')
         return render_template('study_plan.html', plans=[], folders=[])
 
+def serialize_study_plan(plan):
+    return {
+        'id': plan.id,
+        'title': plan.title,
+        'category': plan.category,
+        'progress': plan.progress,
+        'priority': plan.priority,
+        'daily_study_time': plan.daily_study_time,
+        'created_at': plan.created_at.isoformat(),
+        'url': url_for('view_study_plan', plan_id=plan.id)
+    }
+
+@app.route('/study-plan/page')
+@login_required
+def study_plan_page():
+    """One page of the user's study plans, newest first"""
+    from models import StudyPlan, Folder
+    try:
+        plans, next_cursor = request_page(StudyPlan.query.filter_by(user_id=current_user.id), StudyPlan)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    folders = Folder.query.filter_by(user_id=current_user.id).all()
+    return page_response(plans, next_cursor, serialize_study_plan, 'partials/study_plan_rows.html',
+                         plans=plans, folders=folders)
+
 @app.route('/study-plan/<int:plan_id>/session/start', methods=['POST'])
 @login_required
 def start_study_session(plan_id):
@@ -209,6 +279,13 @@ def delete_study_plan(plan_id):
         db.session.delete(study_plan)
         db.session.commit()
 
+        # The plan is gone either way; a stale index entry must not turn that into an error
+        try:
+            import vector_index
+            vector_index.remove_source(current_user.id, f"study_plan:{plan_id}")
+        except Exception as index_error:
+            logger.error(f"Error removing study plan {plan_id} from index: {str(index_error)}")
+
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error deleting study plan: {str(e)}") # Updated logger
@@ -218,7 +295,205 @@ def delete_study_plan(plan_id):
 @login_required
 def documents():
     """Render the documents page"""
-    return render_template('documents.html')
+    from models import Document
+    user_documents, next_cursor = keyset_page(Document.query.filter_by(user_id=current_user.id), Document)
+    return render_template('documents.html', documents=user_documents, next_cursor=next_cursor)
+
+def serialize_document(document):
+    return {
+        'id': document.id,
+        'original_filename': document.original_filename,
+        'file_type': document.file_type,
+        'category': document.category,
+        'processed': document.processed,
+        'created_at': document.created_at.isoformat(),
+        'url': url_for('view_document', doc_id=document.id)
+    }
+
+@app.route('/documents/page')
+@login_required
+def documents_page():
+    """One page of the user's documents, newest first"""
+    from models import Document
+    try:
+        user_documents, next_cursor = request_page(Document.query.filter_by(user_id=current_user.id), Document)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return page_response(user_documents, next_cursor, serialize_document, 'partials/document_rows.html',
+                         documents=user_documents)
+
+@app.route('/documents/events')
+@login_required
+def document_events():
+    """Stream document processing progress over SSE instead of polling the database"""
+    import progress_events
+    user_id = current_user.id
+    # The page passes its still-processing ids so events it missed before connecting are replayed
+    doc_ids = [int(i) for i in request.args.get('ids', '').split(',') if i.isdigit()]
+
+    def finished(event):
+        return event.get('processed') or event['status'] == 'failed'
+
+    def generate():
+        yield ": stream-open\n\n"
+        with progress_events.subscription(user_id) as pubsub:
+            pending = set(doc_ids)
+            for event in progress_events.latest(doc_ids):
+                yield sse_event(event, event='progress')
+                if finished(event):
+                    pending.discard(event['doc_id'])
+            # The stream is bounded; the page reconnects with whatever is still pending
+            for event in progress_events.listen(pubsub) if pending else ():
+                if event is None:
+                    # Comment lines keep proxies from closing an idle stream
+                    yield ": heartbeat\n\n"
+                    continue
+                yield sse_event(event, event='progress')
+                if finished(event):
+                    pending.discard(event['doc_id'])
+                    if not pending:
+                        return
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/documents/<int:doc_id>')
+@login_required
+def view_document(doc_id):
+    """Render a processed document's study material"""
+    from models import Document
+    document = Document.query.filter_by(id=doc_id, user_id=current_user.id).first_or_404()
+    return render_template('document_view.html', document=document, content=document.structured_content)
+
+# File types accepted as study material, by extension
+DOCUMENT_FILE_TYPES = {'.pdf': 'pdf', '.png': 'image', '.jpg': 'image', '.jpeg': 'image'}
+
+def create_document(user_id, original_filename, file_type, filename, content=None):
+    """Create a Document and enqueue its processing pipeline, reusing the user's copy of identical files"""
+    from models import Document
+    from celery_worker import process_document_pipeline
+
+    if file_type != 'link':
+        document = Document.query.filter_by(user_id=user_id, filename=filename).first()
+        if document:
+            logger.info(f"User {user_id} re-uploaded {original_filename}, reusing document {document.id}")
+            if not document.processed:
+                process_document_pipeline(document)  # No-op while a run is already in flight
+            return document
+
+    document = Document(
+        user_id=user_id,
+        filename=filename[:255],
+        original_filename=original_filename[:255],
+        file_type=file_type,
+        content=content
+    )
+    db.session.add(document)
+    db.session.commit()
+    process_document_pipeline(document)
+    return document
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def start_upload():
+    """Start a resumable upload; the client then PUTs chunks at increasing offsets"""
+    import blob_store
+    data = request.get_json() or {}
+    filename = secure_filename(data.get('filename', ''))
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in DOCUMENT_FILE_TYPES:
+        return jsonify({'error': 'Only PDF and image files are supported'}), 400
+
+    try:
+        upload = blob_store.create_upload(current_user.id, filename, int(data.get('size', 0)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'upload_id': upload['upload_id'],
+        'offset': upload['offset'],
+        'chunk_size': blob_store.UPLOAD_CHUNK_BYTES
+    }), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """Report how many bytes of an upload the server holds, so the client can resume"""
+    import blob_store
+    upload = blob_store.get_upload(upload_id, current_user.id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'offset': upload['offset'], 'size': upload['size'], 'complete': bool(upload['blob']),
+                    'chunk_size': blob_store.UPLOAD_CHUNK_BYTES})
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """Append the request body at the Upload-Offset header, streaming it straight to disk"""
+    import blob_store
+    upload = blob_store.get_upload(upload_id, current_user.id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    if upload['blob']:
+        return jsonify({'offset': upload['size'], 'complete': True})
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        offset = blob_store.append_chunk(upload, offset, request.stream, request.content_length or 0)
+    except blob_store.UploadOffsetError as e:
+        return jsonify({'error': 'Offset mismatch', 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'offset': offset, 'complete': offset == upload['size']})
+
+@app.route('/upload', methods=['POST'])
+@login_required
+def upload():
+    """Turn finished resumable uploads, direct file posts and links into documents"""
+    try:
+        import blob_store
+        documents = []
+
+        for upload_id in request.form.getlist('upload_ids'):
+            upload = blob_store.get_upload(upload_id, current_user.id)
+            if not upload or not upload['blob']:
+                return jsonify({'success': False, 'error': f'Upload {upload_id} is not complete'}), 400
+            extension = os.path.splitext(upload['filename'])[1].lower()
+            documents.append(create_document(
+                current_user.id, upload['filename'], DOCUMENT_FILE_TYPES[extension], upload['blob']))
+            blob_store.consume_upload(upload)
+
+        # Small files may still be posted directly; werkzeug spools them to disk, not memory
+        for file in request.files.getlist('files'):
+            filename = secure_filename(file.filename or '')
+            extension = os.path.splitext(filename)[1].lower()
+            if extension not in DOCUMENT_FILE_TYPES:
+                return jsonify({'success': False, 'error': f'Unsupported file type: {file.filename}'}), 400
+            name, _ = blob_store.save_stream(file.stream, extension)
+            documents.append(create_document(current_user.id, filename, DOCUMENT_FILE_TYPES[extension], name))
+
+        link = request.form.get('link', '').strip()
+        if link:
+            documents.append(create_document(current_user.id, link, 'link', link, content=link))
+
+        if not documents:
+            return jsonify({'success': False, 'error': 'No files or link provided'}), 400
+
+        return jsonify({'success': True, 'document_ids': [document.id for document in documents]})
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error uploading documents: {str(e)}")
+        return jsonify({'success': False, 'error': 'Upload failed'}), 500
 
 @app.route('/folders')
 @login_required
@@ -230,19 +505,16 @@ def folders():
         # Get all folders for the user
         folders = Folder.query.filter_by(user_id=current_user.id).all()
 
-        # Get unorganized study plans and documents
-        study_plans = StudyPlan.query.filter_by(
-            user_id=current_user.id
-        ).filter(~StudyPlan.folders.any()).all()
-
-        documents = Document.query.filter_by(
-            user_id=current_user.id
-        ).filter(~Document.folders.any()).all()
+        # First page of unorganized study plans and documents
+        study_plans, study_plans_cursor = keyset_page(unfiled_study_plans_query(), StudyPlan)
+        documents, documents_cursor = keyset_page(unfiled_documents_query(), Document)
 
         return render_template('folders.html', 
                             folders=folders,
                             study_plans=study_plans,
-                            documents=documents)
+                            documents=documents,
+                            study_plans_cursor=study_plans_cursor,
+                            documents_cursor=documents_cursor)
     except Exception as e:
         logger.error(f"Error loading folders: {str(e)}") # Updated logger
         return render_template('folders.html', 
@@ -250,6 +522,40 @@ def folders():
                             study_plans=[],
                             documents=[])
 
+def unfiled_study_plans_query():
+    from models import StudyPlan
+    return StudyPlan.query.filter_by(user_id=current_user.id).filter(~StudyPlan.folders.any())
+
+def unfiled_documents_query():
+    from models import Document
+    return Document.query.filter_by(user_id=current_user.id).filter(~Document.folders.any())
+
+@app.route('/folders/study-plans')
+@login_required
+def unfiled_study_plans_page():
+    """One page of the study plans not yet in a folder"""
+    from models import StudyPlan, Folder
+    try:
+        study_plans, next_cursor = request_page(unfiled_study_plans_query(), StudyPlan)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    folders = Folder.query.filter_by(user_id=current_user.id).all()
+    return page_response(study_plans, next_cursor, serialize_study_plan, 'partials/folder_study_plan_rows.html',
+                         study_plans=study_plans, folders=folders)
+
+@app.route('/folders/documents')
+@login_required
+def unfiled_documents_page():
+    """One page of the documents not yet in a folder"""
+    from models import Document, Folder
+    try:
+        documents, next_cursor = request_page(unfiled_documents_query(), Document)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    folders = Folder.query.filter_by(user_id=current_user.id).all()
+    return page_response(documents, next_cursor, serialize_document, 'partials/folder_document_rows.html',
+                         documents=documents, folders=folders)
+
 @app.route('/folders', methods=['POST'])
 @login_required
 def create_folder():
@@ -315,8 +621,31 @@ def add_to_folder(folder_id):
 def interview_practice():
     """Render the interview practice page"""
     from models import InterviewQuestion
-    questions = InterviewQuestion.query.filter_by(user_id=current_user.id).all()
-    return render_template('interview_practice.html', questions=questions)
+    # Oldest first, so a generated set reads in the order it was asked
+    questions, next_cursor = keyset_page(
+        InterviewQuestion.query.filter_by(user_id=current_user.id), InterviewQuestion, newest_first=False)
+    return render_template('interview_practice.html', questions=questions, next_cursor=next_cursor)
+
+@app.route('/interview-practice/questions')
+@login_required
+def interview_questions_page():
+    """One page of the user's interview questions, oldest first"""
+    from models import InterviewQuestion
+    try:
+        questions, next_cursor = request_page(
+            InterviewQuestion.query.filter_by(user_id=current_user.id), InterviewQuestion, newest_first=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return page_response(questions, next_cursor, lambda q: {
+        'id': q.id,
+        'question': q.question,
+        'category': q.category,
+        'difficulty': q.difficulty,
+        'success_rate': q.success_rate,
+        'created_at': q.created_at.isoformat()
+    }, 'partials/interview_question_rows.html', questions=questions)
+
+INTERVIEW_QUESTION_COUNT = 5
 
 @app.route('/interview-practice/generate', methods=['POST'])
 @login_required
@@ -324,6 +653,8 @@ def generate_interview_questions():
     """Generate interview questions based on job description"""
     try:
         from models import InterviewQuestion, InterviewPractice
+        from ai_helper import analyze_ats_compatibility, generate_interview_questions as generate_interview_question_list
+        import question_bank
         logger.info("Starting question generation process") # Updated logger
 
         data = request.get_json()
@@ -338,138 +669,62 @@ def generate_interview_questions():
             logger.error("No job description provided") # Updated logger
             return jsonify({'error': 'Job description is required', 'success': False}), 400
 
-        # Delete practices first to avoid FK constraint violation
-        try:
-            logger.info("Cleaning up existing practice records") # Updated logger
-            InterviewPractice.query.filter(
-                InterviewPractice.question_id.in_(
-                    db.session.query(InterviewQuestion.id).filter_by(user_id=current_user.id)
-                )
-            ).delete(synchronize_session=False)
-            db.session.commit()
-
-            logger.info("Cleaning up existing questions") # Updated logger
-            InterviewQuestion.query.filter_by(user_id=current_user.id).delete()
-            db.session.commit()
-        except Exception as db_error:
-            logger.error(f"Database cleanup error: {str(db_error)}") # Updated logger
-            db.session.rollback()
-            return jsonify({'error': 'Database error during cleanup', 'success': False}), 500
-
-        # Generate compatibility analysis if resume is provided
-        compatibility = None
-        if resume:
-            try:
-                compatibility_prompt = f"""As an ATS (Applicant Tracking System) expert, analyze the compatibility between this resume and job description:
-
-Resume:
-{resume[:1000]}
-
-Job Description:
-{job_description[:500]}
-
-Provide a detailed ATS analysis in this exact JSON format:
-{{
-    "compatibility_score": (overall match percentage between 0-100),
-    "ats_score": (ATS readability score between 0-100),
-    "keyword_match_rate": (percentage of key terms matched between 0-100),
-    "strengths": [list of 3-5 key matching strengths with specific examples],
-    "gaps": [list of 2-3 missing skills or experiences],
-    "key_matches": [list of 4-5 important keywords found in both],
-    "missing_keywords": [list of 3-4 important keywords from job description not found in resume],
-    "format_suggestions": [list of 2-3 ATS-friendly formatting suggestions if any]
-}}"""
-
-                compatibility_response = openai_client.chat.completions.create(
-                    model="gpt-4", # Changed to gpt-4
-                    messages=[
-                        {"role": "system", "content": "You are an expert ATS analyst specializing in technical roles."},
-                        {"role": "user", "content": compatibility_prompt}
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.7
-                )
-
-                compatibility = json.loads(compatibility_response.choices[0].message.content)
-                logger.info("Generated ATS compatibility analysis") # Updated logger
+        # Common postings are served from the shared question bank; only a miss waits on GPT-4
+        bank_sample = question_bank.sample(job_description, current_user.id, INTERVIEW_QUESTION_COUNT)
+        questions = bank_sample.questions
 
-            except Exception as analysis_error:
-                logger.error(f"Error generating compatibility analysis: {str(analysis_error)}") # Updated logger
-                # Continue without compatibility analysis if it fails
+        # The ATS analysis and question generation are independent; run them side by side
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            questions_future = None if questions else executor.submit(
+                generate_interview_question_list, job_description, INTERVIEW_QUESTION_COUNT)
+            compatibility_future = executor.submit(analyze_ats_compatibility, resume, job_description) if resume else None
 
-        # Generate interview questions
-        questions_prompt = f"""Generate 5 interview questions based on this job description:
-
-{job_description[:500]}
-
-For each question, use this EXACT format with no variations:
-
-Question: [The interview question]
-Category: [Technical/Behavioral]
-Difficulty: [Easy/Medium/Hard]
-
-Generate exactly 5 questions."""
-
-        logger.info("Sending request to OpenAI") # Updated logger
-        try:
-            response = openai_client.chat.completions.create(
-                model="gpt-4", # Changed to gpt-4
-                messages=[
-                    {"role": "system", "content": "You are an expert interviewer generating questions."},
-                    {"role": "user", "content": questions_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-
-            content = response.choices[0].message.content
-            logger.info(f"Received response from OpenAI: {content}") # Updated logger
-
-        except Exception as openai_error:
-            logger.error(f"OpenAI API error: {str(openai_error)}") # Updated logger
-            return jsonify({'error': f'Failed to generate questions: {str(openai_error)}', 'success': False}), 500
-
-        # Parse questions
-        questions = []
-        current_question = {}
-
-        for line in content.split('\n'):
-            line = line.strip()
-            if not line:
-                continue
-
-            if line.startswith('Question:'):
-                if current_question:
-                    questions.append(current_question)
-                current_question = {'question': line[9:].strip()}
-            elif line.startswith('Category:'):
-                current_question['category'] = line[9:].strip()
-            elif line.startswith('Difficulty:'):
-                current_question['difficulty'] = line[11:].strip()
-                questions.append(current_question)
-                current_question = {}
+            if questions_future:
+                try:
+                    questions = questions_future.result()
+                except Exception as openai_error:
+                    logger.error(f"OpenAI API error: {str(openai_error)}") # Updated logger
+                    return jsonify({'error': f'Failed to generate questions: {str(openai_error)}', 'success': False}), 500
+            compatibility = compatibility_future.result() if compatibility_future else None
 
         if not questions:
-            logger.error(f"Failed to parse questions from response: {content}") # Updated logger
+            logger.error("Failed to parse questions from response") # Updated logger
             return jsonify({'error': 'Failed to generate valid questions', 'success': False}), 500
 
+        if questions_future:
+            try:
+                posting = question_bank.get_or_create_posting(job_description)
+                banked = question_bank.add_questions(posting, questions)
+                question_bank.mark_seen(current_user.id, posting.id, [q.id for q in banked])
+            except Exception as bank_error:
+                # The user still gets their questions; the bank just misses this batch
+                logger.error(f"Question bank error: {str(bank_error)}")
+                db.session.rollback()
+        elif bank_sample.needs_top_up:
+            from celery_worker import top_up_question_bank_task
+            top_up_question_bank_task.delay(bank_sample.posting_id)
+
         logger.info(f"Successfully parsed {len(questions)} questions") # Updated logger
 
-        # Save questions to database
-        saved_questions = []
+        # Replace the user's previous questions in a single transaction
         try:
-            for q in questions:
-                if all(k in q for k in ['question', 'category', 'difficulty']):
-                    question = InterviewQuestion(
-                        user_id=current_user.id,
-                        question=q['question'],
-                        category=q['category'],
-                        difficulty=q['difficulty'],
-                        job_description=job_description[:500],
-                        success_rate=random.randint(75, 95)
-                    )
-                    db.session.add(question)
-                    saved_questions.append(question)
+            user_question_ids = db.session.query(InterviewQuestion.id).filter_by(user_id=current_user.id)
+            # Delete practices first to avoid FK constraint violation
+            db.session.execute(
+                delete(InterviewPractice).where(InterviewPractice.question_id.in_(user_question_ids.scalar_subquery())))
+            db.session.execute(delete(InterviewQuestion).where(InterviewQuestion.user_id == current_user.id))
+
+            saved_questions = db.session.scalars(
+                insert(InterviewQuestion).returning(InterviewQuestion),
+                [{
+                    'user_id': current_user.id,
+                    'question': q['question'],
+                    'category': q['category'],
+                    'difficulty': q['difficulty'],
+                    'job_description': job_description[:500],
+                    'success_rate': random.randint(75, 95)
+                } for q in questions]
+            ).all()
 
             db.session.commit()
             logger.info(f"Successfully saved {len(saved_questions)} questions") # Updated logger
@@ -506,7 +761,7 @@ def test_openai():
         logger.info("Testing OpenAI API connection") # Updated logger
         logger.debug(f"OpenAI API Key present: {bool(os.environ.get('OPENAI_API_KEY'))}") # Updated logger
 
-        response = openai_client.chat.completions.create(
+        response = llm_gateway.chat_completion(
             model="gpt-4",  # Using standard gpt-4 model
             messages=[
                 {"role": "user", "content": "Say 'OpenAI connection working!'"}
@@ -584,108 +839,195 @@ def submit_answer(question_id):
             if file.filename == '':
                 return jsonify({'error': 'No selected file'}), 400
 
-            # Save with attempt number in filename
-            filename = secure_filename(f"{question_id}_attempt_{attempt_number}_{datetime.utcnow().timestamp()}.webm")
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            practice.media_url = filename
+            # Stored by content hash; a re-submitted identical recording is kept once
+            import blob_store
+            media_name, _ = blob_store.save_stream(file.stream, '.webm')
+            practice.media_url = media_name
+            practice.user_answer = ''  # Filled in by the transcription job
 
-            # Transcribe audio from media file
-            try:
-                with open(filepath, "rb") as audio_file:
-                    transcript = openai_client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=audio_file
-                    )
-                practice.user_answer = transcript.text
-                logger.info(f"Transcribed answer: {practice.user_answer}") # Updated logger
-            except Exception as e:
-                logger.error(f"Error transcribing audio: {str(e)}") # Updated logger
-                practice.user_answer = f"[{answer_type.upper()} Response - Transcription Failed]"
-
-        # Generate AI feedback for answer
-        feedback_prompt = f"""As an expert interview assessor, analyze this interview answer:
-
-Question: {question.question}
-Expected Answer: {question.sample_answer}
-User's Answer: {practice.user_answer}
-Category: {question.category}
-Attempt Number: {attempt_number}
-
-You MUST format your response as a valid JSON object with exactly these fields:
-{{
-    "score": (a number between 0 and 100),
-    "feedback": "detailed analysis of the answer",
-    "confidence_score": (a number between 0 and 100, required for audio/video responses)
-}}
-
-Respond ONLY with the JSON object, no additional text."""
+        # Transcription and grading take tens of seconds; hand them to a worker
+        practice.status = 'pending'
+        db.session.add(practice)
+        db.session.commit()
 
-        try:
-            logger.info("Sending feedback request to OpenAI") # Updated logger
-            response = openai_client.chat.completions.create(
-                model="gpt-4", # Changed to gpt-4
-                messages=[
-                    {"role": "system", "content": "You are an expert interview assessor. You must return only valid JSON."},
-                    {"role": "user", "content": feedback_prompt}
-                ],
-                temperature=0.3  # Lower temperature for more consistent formatting
-            )
+        from celery_worker import grade_answer_task
+        grade_answer_task.delay(practice.id)
+        return answer_job_response(practice)
 
-            # Log the raw response
-            feedback_data = response.choices[0].message.content
-            logger.debug(f"Raw feedback response: {feedback_data}") # Updated logger
+    except Exception as e:
+        logger.error(f"Error submitting answer: {str(e)}") # Updated logger
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
-            try:
-                feedback_dict = json.loads(feedback_data.strip())
-
-                # Validate response format
-                required_fields = ['score', 'feedback']
-                if answer_type in ['audio', 'video']:
-                    required_fields.append('confidence_score')
-
-                if not all(k in feedback_dict for k in required_fields):
-                    raise ValueError(f"Missing required fields. Got: {list(feedback_dict.keys())}")
-
-                # Validate and normalize scores
-                feedback_dict['score'] = max(0, min(100, float(feedback_dict['score'])))
-                if 'confidence_score' in feedback_dict:
-                    feedback_dict['confidence_score'] = max(0, min(100, float(feedback_dict['confidence_score'])))
-
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse OpenAI response as JSON: {str(e)}") # Updated logger
-                return jsonify({'error': 'Invalid feedback format from AI'}), 500
-            except ValueError as e:
-                logger.error(f"Invalid feedback format: {str(e)}") # Updated logger
-                return jsonify({'error': str(e)}), 500
-
-            practice.score = feedback_dict['score']
-            practice.ai_feedback = feedback_dict['feedback']
-            if answer_type in ['audio', 'video']:
-                practice.confidence_score = feedback_dict.get('confidence_score', 0)
-
-            db.session.add(practice)
-            db.session.commit()
+@app.route('/interview-practice/<int:question_id>/recording', methods=['POST'])
+@login_required
+def start_recording(question_id):
+    """Open a live recording so chunks are transcribed while the user is still answering"""
+    try:
+        from models import InterviewPractice, InterviewQuestion
+        import live_recording
+        InterviewQuestion.query.get_or_404(question_id)
 
+        answer_type = (request.get_json() or {}).get('answer_type')
+        if answer_type not in ['audio', 'video']:
+            return jsonify({'error': 'Answer type must be audio or video'}), 400
+        if not current_user.is_premium:
             return jsonify({
-                'success': True,
-                'feedback': {
-                    'score': practice.score,
-                    'feedback': practice.ai_feedback,
-                    'confidence_score': practice.confidence_score if answer_type in ['audio', 'video'] else None,
-                    'attempt_number': practice.attempt_number
-                }
-            })
+                'error': 'Audio and video responses are premium features. Please upgrade your subscription.',
+                'premium_required': True
+            }), 403
 
-        except Exception as e:
-            logger.error(f"Error generating AI feedback: {str(e)}") # Updated logger
-            db.session.rollback()
-            return jsonify({'error': f'Failed to generate AI feedback: {str(e)}'}), 500
+        practice = InterviewPractice(
+            user_id=current_user.id,
+            question_id=question_id,
+            answer_type=answer_type,
+            attempt_number=InterviewPractice.get_next_attempt_number(current_user.id, question_id),
+            user_answer='',  # Stitched together from the segment transcripts
+            status='recording'
+        )
+        db.session.add(practice)
+        db.session.commit()
+        live_recording.start(practice.id)
+
+        return jsonify({
+            'success': True,
+            'practice_id': practice.id,
+            'chunk_url': url_for('recording_chunk', practice_id=practice.id),
+            'finish_url': url_for('finish_recording', practice_id=practice.id)
+        }), 201
 
     except Exception as e:
-        logger.error(f"Error submitting answer: {str(e)}") # Updated logger
+        logger.error(f"Error starting recording: {str(e)}")
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/interview-practice/recordings/<int:practice_id>/chunks', methods=['POST'])
+@login_required
+def recording_chunk(practice_id):
+    """Append a MediaRecorder chunk and queue transcription of every segment it completes"""
+    from models import InterviewPractice
+    from celery_worker import transcribe_segment_task
+    import live_recording
+    InterviewPractice.query.filter_by(id=practice_id, user_id=current_user.id, status='recording').first_or_404()
+
+    try:
+        index = int(request.headers.get('Chunk-Index', ''))
+        recorded_seconds = float(request.headers.get('Recorded-Seconds', 0))
+        ready = live_recording.append_chunk(
+            practice_id, index, request.stream, request.content_length or 0, recorded_seconds)
+    except live_recording.ChunkOrderError as e:
+        return jsonify({'error': 'Chunk out of order', 'expected': e.expected}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    for start, end, segment_index in ready:
+        transcribe_segment_task.delay(practice_id, segment_index, start, end)
+    return jsonify({'success': True, 'next_chunk': index + 1, 'segments_queued': len(ready)})
+
+@app.route('/interview-practice/recordings/<int:practice_id>/finish', methods=['POST'])
+@login_required
+def finish_recording(practice_id):
+    """Close a live recording, transcribe its tail and grade the stitched answer"""
+    try:
+        from models import InterviewPractice
+        from celery_worker import grade_answer_task, transcribe_segment_task
+        import live_recording
+        practice = InterviewPractice.query.filter_by(
+            id=practice_id, user_id=current_user.id, status='recording').first_or_404()
+
+        recorded_seconds = float((request.get_json() or {}).get('recorded_seconds', 0))
+        media_name, ready, _ = live_recording.finish(practice_id, recorded_seconds)
+        for start, end, segment_index in ready:
+            transcribe_segment_task.delay(practice_id, segment_index, start, end)
+
+        practice.media_url = media_name
+        practice.status = 'pending'
+        db.session.commit()
+
+        grade_answer_task.delay(practice.id)
+        return answer_job_response(practice)
+
+    except Exception as e:
+        logger.error(f"Error finishing recording: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def answer_job_response(practice):
+    """202 response pointing the client at a queued grading job"""
+    return jsonify({
+        'success': True,
+        'status': practice.status,
+        'job_id': practice.id,
+        'attempt_number': practice.attempt_number,
+        'status_url': url_for('answer_job_status', practice_id=practice.id),
+        'events_url': url_for('answer_job_events', practice_id=practice.id)
+    }), 202
+
+def answer_job_payload(practice):
+    """Status payload for a graded (or still grading) answer"""
+    payload = {'job_id': practice.id, 'status': practice.status}
+    if practice.status == 'completed':
+        payload['feedback'] = {
+            'score': practice.score,
+            'feedback': practice.ai_feedback,
+            'confidence_score': practice.confidence_score if practice.answer_type in ['audio', 'video'] else None,
+            'attempt_number': practice.attempt_number
+        }
+    elif practice.status == 'failed':
+        payload['error'] = practice.ai_feedback
+    return payload
+
+@app.route('/interview-practice/jobs/<int:practice_id>')
+@login_required
+def answer_job_status(practice_id):
+    """Poll a grading job; answered from Redis, falling back to the database"""
+    import progress_events
+    for event in progress_events.latest([practice_id], topic='practice'):
+        if event['user_id'] == current_user.id:
+            return jsonify(event)
+
+    from models import InterviewPractice
+    practice = InterviewPractice.query.filter_by(id=practice_id, user_id=current_user.id).first_or_404()
+    return jsonify(answer_job_payload(practice))
+
+@app.route('/interview-practice/jobs/<int:practice_id>/events')
+@login_required
+def answer_job_events(practice_id):
+    """Stream a grading job's status over SSE until it completes or fails"""
+    import progress_events
+    from models import InterviewPractice
+    user_id = current_user.id
+    practice = InterviewPractice.query.filter_by(id=practice_id, user_id=user_id).first_or_404()
+
+    def generate():
+        yield ": stream-open\n\n"
+        with progress_events.subscription(user_id, topic='practice') as pubsub:
+            # Snapshot after subscribing, so a job that finishes in between still reports
+            snapshot = progress_events.latest([practice_id], topic='practice')
+            if not snapshot:
+                db.session.refresh(practice)
+                snapshot = [answer_job_payload(practice)]
+            for event in snapshot:
+                yield sse_event(event, event='status')
+                if event['status'] in ('completed', 'failed'):
+                    return
+            # Bounded like every progress stream; the page falls back to polling when it ends
+            for event in progress_events.listen(pubsub):
+                if event is None:
+                    yield ": heartbeat\n\n"
+                elif event['job_id'] == practice_id:
+                    yield sse_event(event, event='status')
+                    if event['status'] in ('completed', 'failed'):
+                        return
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 @app.route('/interview-practice/export', methods=['POST'])
 @login_required
@@ -717,6 +1059,7 @@ def export_interview_data():
                     'score': p.score,
                     'ai_feedback': p.ai_feedback,
                     'confidence_score': p.confidence_score if p.answer_type in ['audio', 'video'] else None,
+                    'status': p.status,
                     'created_at': p.created_at.isoformat()
                 } for p in practices]
             }
@@ -821,6 +1164,13 @@ def create_study_plan():
                 logger.error(f"Database error while saving study plan: {str(db_error)}") # Updated logger
                 return jsonify({'error': 'Failed to save study plan to database', 'success': False}), 500
 
+            # Make the new plan available to tutor-mode retrieval
+            try:
+                import vector_index
+                vector_index.index_study_plan(study_plan)
+            except Exception as index_error:
+                logger.error(f"Error indexing study plan {study_plan.id}: {str(index_error)}")
+
             return jsonify({
                 'success': True,
                 'plan_id': study_plan.id
@@ -834,6 +1184,27 @@ def create_study_plan():
         logger.error(f"Error creating study plan: {str(e)}") # Updated logger
         return jsonify({'error': str(e), 'success': False}), 500
 
+@app.route('/chat/history')
+@login_required
+def chat_history_page():
+    """One page of the user's chat history, newest first; ?study_plan_id= narrows it to one plan"""
+    from models import ChatHistory
+    query = ChatHistory.query.filter_by(user_id=current_user.id)
+    if request.args.get('study_plan_id', type=int):
+        query = query.filter_by(study_plan_id=request.args.get('study_plan_id', type=int))
+    try:
+        records, next_cursor = request_page(query, ChatHistory)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return page_response(records, next_cursor, lambda record: {
+        'id': record.id,
+        'question': record.question,
+        'answer': record.answer,
+        'study_plan_id': record.study_plan_id,
+        'related_document_id': record.related_document_id,
+        'created_at': record.created_at.isoformat()
+    })
+
 @app.route('/chat', methods=['POST'])
 @login_required
 def chat():
@@ -857,6 +1228,14 @@ def chat():
                 context = "Here's some relevant information from the user's materials:\n" + \
                          "\n".join([f"From {item['title']}:\n{item['content']}" for item in context])
 
+        # Stream tokens over SSE when the client asks for it
+        if data.get('stream'):
+            from ai_helper import stream_chat_response
+            return stream_chat_reply(
+                stream_chat_response(message, context, tutor_mode, current_user.id),
+                current_user.id,
+                message)
+
         # Generate response using AI helper
         from ai_helper import chat_response
         try:
@@ -945,9 +1324,18 @@ Content from the study plan:
             logger.debug(f"Sending chat request with tutor_mode={bool(context)}") # Updated logger
             logger.debug(f"Context available: {bool(context)}") # Updated logger
 
-            response = openai_client.chat.completions.create(
+            if data.get('stream'):
+                from ai_helper import stream_chat_completion
+                return stream_chat_reply(
+                    stream_chat_completion(messages),
+                    current_user.id,
+                    message,
+                    study_plan_id=plan_id if plan_id else None)
+
+            response = llm_gateway.chat_completion(
                 model="gpt-4",
                 messages=messages,
+                hedge=True
             )
 
             ai_response = response.choices[0].message.content
@@ -980,4 +1368,5 @@ Content from the study plan:
         logger.error(f"Error in chat handler: {str(e)}") # Updated logger
         return jsonify({'error': str(e)}), 500
 import json
+import random
 from datetime import datetime
\ No newline at end of file
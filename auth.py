@@ -1,7 +1,8 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
 from models import User, db
+from pagination import keyset_page, request_page, page_response
 from email_validator import validate_email, EmailNotValidError
 import re
 
@@ -118,5 +119,54 @@ def admin_users():
         flash('Access denied.')
         return redirect(url_for('index'))
 
-    users = User.query.all()
-    return render_template('auth/admin_users.html', users=users)
\ No newline at end of file
+    users, next_cursor = keyset_page(User.query, User)
+    return render_template('auth/admin_users.html', users=users, next_cursor=next_cursor)
+
+@auth.route('/admin/users/page')
+@login_required
+def admin_users_page():
+    """One page of users, newest first"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    try:
+        users, next_cursor = request_page(User.query, User)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return page_response(users, next_cursor, lambda user: {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'is_admin': user.is_admin,
+        'created_at': user.created_at.isoformat()
+    }, 'partials/admin_user_rows.html', users=users)
+
+@auth.route('/admin/semantic-cache')
+@login_required
+def admin_semantic_cache():
+    """Report semantic cache hit rate, latency saved and sampled false hits"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    from semantic_cache import semantic_cache
+    return jsonify(semantic_cache.stats())
+
+@auth.route('/admin/extraction-cache')
+@login_required
+def admin_extraction_cache():
+    """Report extraction cache hits and misses"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    import extraction_cache
+    return jsonify(extraction_cache.stats())
+
+@auth.route('/admin/cache-codec')
+@login_required
+def admin_cache_codec():
+    """Report estimated bytes saved by the cache codec per key namespace"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    from cache_helper import codec_stats
+    return jsonify(codec_stats())
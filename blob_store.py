@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import logging
+from extensions import app
+
+logger = logging.getLogger(__name__)
+
+# Upload settings, overridable per deployment
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 500 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', 8 * 1024 * 1024))  # Largest accepted PUT body
+UPLOAD_STALE_SECONDS = int(os.environ.get('UPLOAD_STALE_SECONDS', 86400))
+COPY_BUFFER_BYTES = 1024 * 1024
+
+UPLOAD_ROOT = app.config['UPLOAD_FOLDER']
+PARTIAL_DIR = os.path.join(UPLOAD_ROOT, 'partial')
+TMP_DIR = os.path.join(UPLOAD_ROOT, 'tmp')
+
+class UploadOffsetError(ValueError):
+    """A chunk did not start where the stored upload ends; offset says where to resume"""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at byte {offset}")
+        self.offset = offset
+
+def blob_name(digest, extension=''):
+    """Storage name relative to the upload folder, sharded by hash prefix: blobs/ab/cd/abcd..."""
+    return os.path.join('blobs', digest[:2], digest[2:4], digest + extension.lower())
+
+def blob_path(name):
+    """Absolute path of a stored blob name, as saved on Document.filename or media_url"""
+    return os.path.join(UPLOAD_ROOT, name)
+
+def _commit(tmp_path, digest, extension):
+    """Move a fully written temp file into the blob store; identical content is kept once"""
+    name = blob_name(digest, extension)
+    path = blob_path(name)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        logger.info(f"Deduplicated upload into existing blob {name}")
+        return name, False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+    return name, True
+
+def save_stream(stream, extension=''):
+    """Copy a file-like stream into the blob store without holding it in memory; returns (name, size)"""
+    os.makedirs(TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(TMP_DIR, uuid.uuid4().hex)
+    digest, size = hashlib.sha256(), 0
+    try:
+        with open(tmp_path, 'wb') as tmp_file:
+            while True:
+                block = stream.read(COPY_BUFFER_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > UPLOAD_MAX_BYTES:
+                    raise ValueError(f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+                digest.update(block)
+                tmp_file.write(block)
+        name, _ = _commit(tmp_path, digest.hexdigest(), extension)
+        return name, size
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _meta_path(upload_id):
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.json")
+
+def _part_path(upload_id):
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+def _write_meta(upload):
+    tmp_path = _meta_path(upload['upload_id']) + '.tmp'
+    with open(tmp_path, 'w') as meta_file:
+        # The offset is always derived from the part file, never stored
+        json.dump({key: value for key, value in upload.items() if key != 'offset'}, meta_file)
+    os.replace(tmp_path, _meta_path(upload['upload_id']))
+
+def create_upload(user_id, filename, size):
+    """Start a resumable upload of a known size"""
+    if size <= 0 or size > UPLOAD_MAX_BYTES:
+        raise ValueError(f"Upload size must be between 1 and {UPLOAD_MAX_BYTES} bytes")
+
+    purge_stale_uploads()
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    upload = {
+        'upload_id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'filename': filename,
+        'size': size,
+        'blob': None,
+        'created_at': time.time()
+    }
+    open(_part_path(upload['upload_id']), 'wb').close()
+    _write_meta(upload)
+    return dict(upload, offset=0)
+
+def get_upload(upload_id, user_id):
+    """Return an upload with its current offset, or None if it does not exist or is not the user's"""
+    if not upload_id.isalnum():
+        return None
+    try:
+        with open(_meta_path(upload_id)) as meta_file:
+            upload = json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+    if upload['user_id'] != user_id:
+        return None
+
+    if upload['blob']:
+        upload['offset'] = upload['size']
+    else:
+        upload['offset'] = os.path.getsize(_part_path(upload_id))
+    return upload
+
+def append_chunk(upload, offset, stream, length):
+    """Write one chunk at offset and return the new offset, finalizing once the upload is whole"""
+    if length > UPLOAD_CHUNK_BYTES:
+        raise ValueError(f"Chunks may be at most {UPLOAD_CHUNK_BYTES} bytes")
+    if offset + length > upload['size']:
+        raise ValueError("Chunk runs past the declared upload size")
+
+    part_path = _part_path(upload['upload_id'])
+    with open(part_path, 'ab') as part_file:
+        # Serialize retried or parallel PUTs for the same upload across workers
+        fcntl.flock(part_file, fcntl.LOCK_EX)
+        current = part_file.seek(0, os.SEEK_END)
+        if current != offset:
+            raise UploadOffsetError(current)
+
+        remaining = length
+        while remaining:
+            block = stream.read(min(COPY_BUFFER_BYTES, remaining))
+            if not block:
+                break
+            part_file.write(block)
+            remaining -= len(block)
+        part_file.flush()
+        new_offset = part_file.tell()
+
+        if remaining:
+            # Client went away mid-chunk: drop the partial chunk so the offset stays trustworthy
+            part_file.truncate(offset)
+            raise UploadOffsetError(offset)
+
+        if new_offset == upload['size']:
+            upload['blob'] = _finalize(upload)
+    return new_offset
+
+def _finalize(upload):
+    """Hash the assembled file and move it into the blob store"""
+    part_path = _part_path(upload['upload_id'])
+    digest = hashlib.sha256()
+    with open(part_path, 'rb') as part_file:
+        for block in iter(lambda: part_file.read(COPY_BUFFER_BYTES), b''):
+            digest.update(block)
+
+    extension = os.path.splitext(upload['filename'])[1]
+    name, _ = _commit(part_path, digest.hexdigest(), extension)
+    upload['blob'] = name
+    _write_meta(upload)
+    return name
+
+def consume_upload(upload):
+    """Forget a finished upload once its blob has been attached to a record"""
+    for path in (_meta_path(upload['upload_id']), _part_path(upload['upload_id'])):
+        if os.path.exists(path):
+            os.remove(path)
+
+def purge_stale_uploads(max_age_seconds=UPLOAD_STALE_SECONDS):
+    """Delete abandoned partial uploads and temp files"""
+    cutoff = time.time() - max_age_seconds
+    for directory in (PARTIAL_DIR, TMP_DIR):
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError as e:
+                logger.warning(f"Could not remove stale upload file {entry.path}: {e}")
@@ -1,46 +1,478 @@
+import os
+import math
+import time
+import uuid
+import hashlib
 import redis
 import json
+import zlib
+import random
 import logging
+import threading
+from collections import OrderedDict
 from functools import wraps
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 
-# Initialize Redis client
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-def cache_data(key, data, expiry_seconds=3600):
-    """Cache data with Redis"""
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Redis settings, shared with the Celery broker
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+# Every module and thread in a process shares one pool; pub/sub listeners each hold a connection
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 100))
+# Bounds connects and every read, so a hung Redis can't hold a web thread; pub/sub polls with its own timeout
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 5))
+
+redis_pool = redis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    health_check_interval=30,  # Ping idle connections before reuse so restarts don't surface as errors
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+# Cache settings, overridable per deployment
+LOCAL_CACHE_MAX_ENTRIES = int(os.environ.get('LOCAL_CACHE_MAX_ENTRIES', 1024))
+# Other workers can't evict this process's copies, so keep them short-lived
+LOCAL_CACHE_TTL_SECONDS = float(os.environ.get('LOCAL_CACHE_TTL_SECONDS', 30))
+# How long a worker waits for another worker's fill of the same key before computing it anyway
+FILL_WAIT_SECONDS = float(os.environ.get('CACHE_FILL_WAIT_SECONDS', 10))
+FILL_LOCK_SECONDS = 60
+# Higher values refresh earlier; 1.0 is the usual setting for probabilistic early expiry
+EARLY_REFRESH_BETA = float(os.environ.get('CACHE_EARLY_REFRESH_BETA', 1.0))
+# Payloads at least this large are compressed before they go to Redis
+CACHE_COMPRESS_MIN_BYTES = int(os.environ.get('CACHE_COMPRESS_MIN_BYTES', 1024))
+# Share of writes that update the codec stats; each sampled write counts for 1 / rate writes
+CACHE_CODEC_STATS_SAMPLE_RATE = float(os.environ.get('CACHE_CODEC_STATS_SAMPLE_RATE', 0.01))
+# Tag sets outlive any entry they point at; entries are cached for a day at most
+TAG_TTL_SECONDS = 7 * 86400
+
+_RELEASE_FILL_SCRIPT = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+# Encoded values start with CODEC_MAGIC, then one byte naming the serializer and one naming
+# the compression. Plain JSON can never start with 0xAC, so entries written before the
+# header existed are still read as JSON.
+CODEC_MAGIC = b'\xacC'
+CODEC_STATS_KEY = 'cache_codec:stats'
+
+def _json_dumps(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+def _json_key(key):
+    """The string json.dumps turns a dict key into"""
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (bool, int, float)):
+        return json.dumps(key)
+    raise TypeError(f"Cache dict keys must be str, int, float, bool or None, not {type(key).__name__}")
+
+def _json_keys(value):
+    """Stringify dict keys as JSON would, so a value reads back the same whichever serializer wrote it"""
+    if isinstance(value, dict):
+        return {_json_key(k): _json_keys(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_keys(v) for v in value]
+    return value
+
+def _msgpack_dumps(value):
+    return msgpack.packb(_json_keys(value), use_bin_type=True)
+
+def _msgpack_loads(data):
+    if msgpack is None:
+        raise RuntimeError("Cached entry needs msgpack, which is not installed")
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+def _zstd_decompress(data):
+    if zstandard is None:
+        raise RuntimeError("Cached entry needs zstandard, which is not installed")
+    return zstandard.ZstdDecompressor().decompress(data)
+
+SERIALIZERS = {
+    b'j': (_json_dumps, json.loads),
+    b'm': (_msgpack_dumps, _msgpack_loads),
+}
+COMPRESSORS = {
+    b'n': (None, lambda data: data),
+    b'z': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    b's': (_zstd_compress, _zstd_decompress),
+}
+
+# The best codec this process can write with; readers handle every codec
+CACHE_SERIALIZER = os.environ.get('CACHE_SERIALIZER', 'm' if msgpack else 'j').encode()
+CACHE_COMPRESSOR = os.environ.get('CACHE_COMPRESSOR', 's' if zstandard else 'z').encode()
+
+def _namespace(key):
+    return key.split(':', 1)[0]
+
+def encode(value, key=None, pipe=None):
+    """Serialize and, above CACHE_COMPRESS_MIN_BYTES, compress a value; queue sampled size stats on pipe if given"""
+    serialized = SERIALIZERS[CACHE_SERIALIZER][0](value)
+    compression = b'n'
+    if len(serialized) >= CACHE_COMPRESS_MIN_BYTES:
+        compressed = COMPRESSORS[CACHE_COMPRESSOR][0](serialized)
+        if len(compressed) < len(serialized):
+            serialized, compression = compressed, CACHE_COMPRESSOR
+    encoded = CODEC_MAGIC + CACHE_SERIALIZER + compression + serialized
+
+    if pipe is not None and key is not None and random.random() < CACHE_CODEC_STATS_SAMPLE_RATE:
+        # Savings are measured against the plain JSON these entries used to be stored as
+        namespace, weight = _namespace(key), 1.0 / CACHE_CODEC_STATS_SAMPLE_RATE
+        pipe.hincrby(CODEC_STATS_KEY, f"{namespace}:plain_bytes", round(len(_json_dumps(value)) * weight))
+        pipe.hincrby(CODEC_STATS_KEY, f"{namespace}:stored_bytes", round(len(encoded) * weight))
+        pipe.hincrby(CODEC_STATS_KEY, f"{namespace}:entries", round(weight))
+    return encoded
+
+def decode(data):
+    """Inverse of encode; anything without the header is a legacy JSON entry"""
+    if not data.startswith(CODEC_MAGIC):
+        return json.loads(data)
+    serializer, compression = data[2:3], data[3:4]
+    return SERIALIZERS[serializer][1](COMPRESSORS[compression][1](data[4:]))
+
+def codec_stats():
+    """Estimated bytes written per key namespace, before and after encoding, from sampled writes"""
     try:
-        redis_client.setex(key, expiry_seconds, json.dumps(data))
+        raw = {k.decode(): int(v) for k, v in redis_client.hgetall(CODEC_STATS_KEY).items()}
+    except Exception as e:
+        logging.error(f"Cache codec stats error: {str(e)}")
+        return {}
+    stats = {}
+    for field, count in raw.items():
+        namespace, metric = field.rsplit(':', 1)
+        stats.setdefault(namespace, {'plain_bytes': 0, 'stored_bytes': 0, 'entries': 0})[metric] = count
+    for entry in stats.values():
+        entry['saved_bytes'] = entry['plain_bytes'] - entry['stored_bytes']
+        entry['ratio'] = entry['stored_bytes'] / entry['plain_bytes'] if entry['plain_bytes'] else 1.0
+    return stats
+
+class LocalCache:
+    """Bounded in-process LRU of encoded values, each with its own expiry"""
+
+    def __init__(self, max_entries=LOCAL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (encoded value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, encoded, ttl_seconds):
+        ttl_seconds = min(ttl_seconds, LOCAL_CACHE_TTL_SECONDS)
+        if ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (encoded, time.time() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+local_cache = LocalCache()
+
+# Fills in progress in this process, by key; other threads wanting the same key wait on its future.
+# The lock only guards the table, never a fetch or a compute.
+_fills = {}
+_fills_lock = threading.Lock()
+
+def _stable_default(obj):
+    """JSON fallback for key parts: model rows by class and id, other objects by their repr"""
+    if isinstance(obj, (datetime, timedelta)):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    if hasattr(obj, '__table__') and getattr(obj, 'id', None) is not None:
+        return f"{type(obj).__name__}:{obj.id}"
+    return repr(obj)
+
+def digest(*parts):
+    """Deterministic digest of key parts, the same in every process unlike hash()"""
+    payload = json.dumps(parts, sort_keys=True, default=_stable_default, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def _version_key(user_id):
+    return f"data_version:{user_id}"
+
+def data_version(user_id):
+    """Current version of a user's data; part of cache keys so a write makes older entries unreachable
+
+    Held in the local tier like any other entry, so versioned keys are still served without a
+    round trip; another process's write is seen within LOCAL_CACHE_TTL_SECONDS.
+    """
+    key = _version_key(user_id)
+    cached = local_cache.get(key)
+    if cached is not None:
+        return int(cached)
+    try:
+        version = redis_client.get(key) or b'0'
+    except Exception as e:
+        logging.error(f"Data version error: {str(e)}")
+        return 0
+    local_cache.set(key, version, LOCAL_CACHE_TTL_SECONDS)
+    return int(version)
+
+def user_tag(user_id):
+    return f"user:{user_id}"
+
+def invalidate_user_data(user_id):
+    """Call after any write that changes what a user's cached results were built from"""
+    try:
+        redis_client.incr(_version_key(user_id))
+    except Exception as e:
+        logging.error(f"Data version error: {str(e)}")
+    # This process sees the new version at once; others within LOCAL_CACHE_TTL_SECONDS
+    local_cache.delete(_version_key(user_id))
+    # Versioned keys are already unreachable; this just frees them instead of waiting for expiry
+    invalidate_tags(user_tag(user_id))
+
+def _tag_key(tag):
+    return f"cache_tag:{tag}"
+
+def _tag_entry(pipe, key, tags):
+    for tag in tags:
+        pipe.sadd(_tag_key(tag), key)
+        pipe.expire(_tag_key(tag), TAG_TTL_SECONDS)
+
+def invalidate_tags(*tags):
+    """Delete every entry cached with any of these tags"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for tag in tags:
+            pipe.smembers(_tag_key(tag))
+        keys = {member.decode() for members in pipe.execute() for member in members}
+        for key in keys:
+            local_cache.delete(key)
+        stale = [name for key in keys for name in (key, _delta_key(key))] + [_tag_key(tag) for tag in tags]
+        redis_client.delete(*stale)
+    except Exception as e:
+        logging.error(f"Cache invalidation error: {str(e)}")
+
+def _delta_key(key):
+    return f"{key}:delta"
+
+def _lock_key(key):
+    return f"{key}:fill"
+
+def cache_data(key, data, expiry_seconds=3600, tags=()):
+    """Cache data with Redis; tags let invalidate_tags() drop it early"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        encoded = encode(data, key, pipe)
+        pipe.setex(key, expiry_seconds, encoded)
+        _tag_entry(pipe, key, tags)
+        pipe.execute()
+        local_cache.set(key, encoded, expiry_seconds)
         return True
     except Exception as e:
         logging.error(f"Cache error: {str(e)}")
         return False
 
 def get_cached_data(key):
-    """Retrieve cached data"""
+    """Retrieve cached data, from this process's copy when it has one"""
+    encoded = local_cache.get(key)
+    if encoded is not None:
+        return decode(encoded)
     try:
-        data = redis_client.get(key)
-        return json.loads(data) if data else None
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        data, ttl_ms = pipe.execute()
+        if not data:
+            return None
+        local_cache.set(key, data, ttl_ms / 1000.0 if ttl_ms and ttl_ms > 0 else 0)
+        return decode(data)
     except Exception as e:
         logging.error(f"Cache retrieval error: {str(e)}")
         return None
 
+def get_many(keys):
+    """Fetch several keys in one round trip; returns {key: value} for the ones that are cached"""
+    found, missing = {}, []
+    for key in keys:
+        encoded = local_cache.get(key)
+        if encoded is not None:
+            found[key] = decode(encoded)
+        else:
+            missing.append(key)
+    if not missing:
+        return found
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key in missing:
+            pipe.get(key)
+            pipe.pttl(key)
+        replies = pipe.execute()
+        for key, data, ttl_ms in zip(missing, replies[0::2], replies[1::2]):
+            if data:
+                local_cache.set(key, data, ttl_ms / 1000.0 if ttl_ms and ttl_ms > 0 else 0)
+                found[key] = decode(data)
+    except Exception as e:
+        logging.error(f"Cache retrieval error: {str(e)}")
+    return found
+
+def set_many(items, expiry_seconds=3600, tags=()):
+    """Cache a {key: value} mapping in one round trip"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        encoded = {key: encode(value, key, pipe) for key, value in items.items()}
+        for key, data in encoded.items():
+            pipe.setex(key, expiry_seconds, data)
+            _tag_entry(pipe, key, tags)
+        pipe.execute()
+        for key, data in encoded.items():
+            local_cache.set(key, data, expiry_seconds)
+        return True
+    except Exception as e:
+        logging.error(f"Cache error: {str(e)}")
+        return False
+
+def delete_cached_data(key):
+    local_cache.delete(key)
+    try:
+        redis_client.delete(key, _delta_key(key))
+    except Exception as e:
+        logging.error(f"Cache delete error: {str(e)}")
+
+def _should_refresh_early(ttl_seconds, delta_seconds):
+    """Probabilistic early expiry: the closer to expiry and the slower to compute, the likelier a refresh"""
+    if ttl_seconds is None or not delta_seconds:
+        return False
+    return -delta_seconds * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= ttl_seconds
+
+def _compute_and_store(key, compute_fn, expiry_seconds, tags):
+    started = time.time()
+    value = compute_fn()
+    if value is not None:
+        delta = time.time() - started
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            encoded = encode(value, key, pipe)
+            pipe.setex(key, expiry_seconds, encoded)
+            pipe.setex(_delta_key(key), expiry_seconds, f"{delta:.3f}")
+            _tag_entry(pipe, key, tags)
+            pipe.execute()
+            local_cache.set(key, encoded, expiry_seconds)
+        except Exception as e:
+            logging.error(f"Cache error: {str(e)}")
+    return value
+
+def get_or_compute(key, compute_fn, expiry_seconds=3600, tags=()):
+    """Return the cached value for key, or compute, cache and return it
+
+    Only one worker computes a missing key while the others wait for its result,
+    and hot keys are refreshed shortly before they expire rather than all at once after.
+    None results are returned but not cached.
+    """
+    encoded = local_cache.get(key)
+    if encoded is not None:
+        return decode(encoded)
+
+    with _fills_lock:
+        fill = _fills.get(key)
+        leader = fill is None
+        if leader:
+            fill = _fills[key] = Future()
+
+    if not leader:
+        try:
+            value = fill.result(timeout=FILL_WAIT_SECONDS)
+        except FutureTimeoutError:
+            logging.warning(f"Timed out waiting for local fill of {key}, fetching it here")
+            return _fetch_or_compute(key, compute_fn, expiry_seconds, tags)
+        # Decode this process's copy so waiters don't share one mutable result
+        encoded = local_cache.get(key)
+        return decode(encoded) if encoded is not None else value
+
+    try:
+        value = _fetch_or_compute(key, compute_fn, expiry_seconds, tags)
+        fill.set_result(value)
+        return value
+    except BaseException as e:
+        fill.set_exception(e)
+        raise
+    finally:
+        with _fills_lock:
+            _fills.pop(key, None)
+
+def _fetch_or_compute(key, compute_fn, expiry_seconds, tags):
+    """Read key from Redis, or compute it under a cross-process fill lock so other workers wait"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        pipe.get(_delta_key(key))
+        data, ttl_ms, delta = pipe.execute()
+    except Exception as e:
+        logging.error(f"Cache retrieval error: {str(e)}")
+        return compute_fn()
+
+    ttl_seconds = ttl_ms / 1000.0 if ttl_ms and ttl_ms > 0 else None
+    if data is not None and not _should_refresh_early(ttl_seconds, float(delta or 0)):
+        local_cache.set(key, data, ttl_seconds or 0)
+        return decode(data)
+
+    token = uuid.uuid4().hex
+    try:
+        acquired = redis_client.set(_lock_key(key), token, nx=True, ex=FILL_LOCK_SECONDS)
+    except Exception as e:
+        logging.error(f"Cache lock error: {str(e)}")
+        acquired = False
+
+    if not acquired:
+        if data is not None:
+            return decode(data)  # Someone else is already refreshing; the current value is still valid
+        deadline = time.time() + FILL_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(0.1)
+            cached = get_cached_data(key)
+            if cached is not None:
+                return cached
+        logging.warning(f"Timed out waiting for cache fill of {key}, computing it here")
+        return _compute_and_store(key, compute_fn, expiry_seconds, tags)
+
+    try:
+        return _compute_and_store(key, compute_fn, expiry_seconds, tags)
+    finally:
+        try:
+            _RELEASE_FILL_SCRIPT(keys=[_lock_key(key)], args=[token])
+        except Exception as e:
+            logging.error(f"Cache lock release error: {str(e)}")
+
 def cache_decorator(expiry_seconds=3600):
     """Decorator for caching function results"""
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Create a cache key from function name and arguments
-            key = f"{func.__name__}:{str(args)}:{str(kwargs)}"
-            
-            # Try to get cached result
-            cached_result = get_cached_data(key)
-            if cached_result is not None:
-                return cached_result
-            
-            # If not cached, execute function and cache result
-            result = func(*args, **kwargs)
-            cache_data(key, result, expiry_seconds)
-            return result
+            # Create a cache key from the function's full name and a digest of its arguments
+            key = f"{func.__module__}.{func.__qualname__}:{digest(args, kwargs)}"
+            return get_or_compute(key, lambda: func(*args, **kwargs), expiry_seconds)
         return wrapper
     return decorator
@@ -1,12 +1,21 @@
 import os
 import json
-from celery import Celery
+import hashlib
+from celery import Celery, chain
+from kombu import Queue
 from document_processor import DocumentProcessor
-from models import Document, db
+from models import Document, InterviewPractice, QuestionBankPosting, db
+import extraction_cache
+import progress_events
+import task_locks
+import live_recording
+import media_helper
+import speech_metrics
+import question_bank
+from cache_helper import REDIS_URL, cache_data, get_cached_data
 import logging
 
 # Configure Celery
-REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
 celery = Celery('tasks', broker=REDIS_URL)
 celery.conf.update(
     broker_connection_retry_on_startup=True,
@@ -16,13 +25,86 @@ celery.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # One queue per pipeline stage so CPU-bound and IO-bound work get their own worker pools:
+    #   celery -A celery_worker worker -Q extract,chunk -P prefork -n cpu@%h
+    #   celery -A celery_worker worker -Q structure,index,grading,celery -P threads -c 16 -n io@%h
+    task_queues=[Queue('extract'), Queue('chunk'), Queue('structure'), Queue('index'), Queue('grading'),
+                 Queue('celery')],
+    task_routes={
+        'celery_worker.extract_document_task': {'queue': 'extract'},
+        'celery_worker.chunk_document_task': {'queue': 'chunk'},
+        'celery_worker.structure_document_task': {'queue': 'structure'},
+        'celery_worker.index_document_task': {'queue': 'index'},
+        'celery_worker.release_document_lock_task': {'queue': 'index'},
+        'celery_worker.combine_documents_task': {'queue': 'structure'},
+        'celery_worker.grade_answer_task': {'queue': 'grading'},
+        'celery_worker.transcribe_segment_task': {'queue': 'grading'},
+        'celery_worker.top_up_question_bank_task': {'queue': 'grading'},
+    },
+    # Redis emulates message priorities with a sub-queue per step inside each queue; 0 is served first.
+    # The default key separator is kept so messages already sitting in the broker stay reachable.
+    broker_transport_options={'priority_steps': list(range(10))},
+    task_default_priority=5,
+    worker_prefetch_multiplier=1,  # Don't let a worker hoard low-priority jobs
+    task_acks_late=True,
 )
 
+PREMIUM_PRIORITY = 0
+STANDARD_PRIORITY = 5
+
+# A pipeline holds its document's lock from enqueue to the last stage; each stage renews it
+DOCUMENT_LOCK_TTL = int(os.environ.get('DOCUMENT_LOCK_TTL_SECONDS', 1800))
+GRADING_LOCK_TTL = int(os.environ.get('GRADING_LOCK_TTL_SECONDS', 600))
+# How long a segment waits for its predecessor's text to use as a Whisper prompt,
+# and how long grading waits for in-flight segments before transcribing them itself
+SEGMENT_PROMPT_WAIT_SECONDS = 10
+SEGMENT_RESULT_WAIT_SECONDS = 60
+COMBINE_LOCK_TTL = int(os.environ.get('COMBINE_LOCK_TTL_SECONDS', 300))
+COMBINE_CACHE_TTL = int(os.environ.get('COMBINE_CACHE_TTL_SECONDS', 86400))
+QUESTION_BANK_LOCK_TTL = 300
+
 doc_processor = DocumentProcessor()
 
+def _document_lock(doc_id):
+    return f"document:{doc_id}"
+
+def _pipeline_active(doc_id, lock_token):
+    """False once this run's document lock expired or was taken over by another run"""
+    if task_locks.owns(_document_lock(doc_id), lock_token, DOCUMENT_LOCK_TTL):
+        return True
+    logging.warning(f"Lost processing lock for document {doc_id}, abandoning this run")
+    return False
+
+def combine_cache_key(documents):
+    """Memo key for a combination: sorted document ids plus each one's content version"""
+    versions = ','.join(
+        f"{document.id}:{document.updated_at.isoformat() if document.updated_at else ''}"
+        for document in sorted(documents, key=lambda document: document.id))
+    return f"combine:{hashlib.sha256(versions.encode('utf-8')).hexdigest()}"
+
+def process_document_pipeline(document):
+    """Enqueue extract -> chunk -> structure -> index for a document, premium users first"""
+    # Duplicate requests collapse here: only one pipeline per document may be in flight
+    lock_token = task_locks.acquire(_document_lock(document.id), DOCUMENT_LOCK_TTL)
+    if not lock_token:
+        logging.info(f"Document {document.id} is already being processed, skipping duplicate")
+        return None
+
+    priority = PREMIUM_PRIORITY if document.user.is_premium else STANDARD_PRIORITY
+    progress_events.publish(document.user_id, document.id, 'extract', 'queued')
+    release = release_document_lock_task.si(document.id, lock_token)
+    return chain(
+        extract_document_task.si(document.id, lock_token).set(priority=priority),
+        chunk_document_task.s().set(priority=priority),
+        structure_document_task.s().set(priority=priority),
+        index_document_task.s().set(priority=priority),
+        # Runs after a stage stops the chain early too; link_error covers stages that raise
+        release.set(priority=priority),
+    ).apply_async(link_error=release)
+
 @celery.task
 def process_document_task(doc_id):
-    """Process document in background"""
+    """Process document in background by starting its stage pipeline"""
     try:
         from app import app
         with app.app_context():
@@ -30,38 +112,346 @@ def process_document_task(doc_id):
             if not document:
                 logging.error(f"Document {doc_id} not found")
                 return
+            if document.processed:
+                logging.info(f"Document {doc_id} is already processed, skipping")
+                return
 
-            if document.file_type == 'image':
-                structured_content = doc_processor.process_document('image', document.filename)
-            elif document.file_type == 'link':
-                structured_content = doc_processor.process_document('link', document.content)
-            elif document.file_type == 'pdf':
-                structured_content = doc_processor.process_document('pdf', document.filename)
-
-            if structured_content:
-                content_dict = json.loads(structured_content)
-                document.structured_content = structured_content
-                document.category = content_dict.get('category', 'Uncategorized')
-                document.processed = True
-                db.session.commit()
-                logging.info(f"Successfully processed document {doc_id}")
+            process_document_pipeline(document)
+
+    except Exception as e:
+        logging.error(f"Error processing document {doc_id}: {str(e)}", exc_info=True)
+        raise
+
+@celery.task
+def extract_document_task(doc_id, lock_token):
+    """Stage 1 (CPU): extract raw text via OCR, PDF parsing or link fetching"""
+    if not _pipeline_active(doc_id, lock_token):
+        return None
+    user_id = None
+    try:
+        from app import app
+        with app.app_context():
+            document = Document.query.get(doc_id)
+            if not document:
+                logging.error(f"Document {doc_id} not found")
+                return None
+            user_id = document.user_id
+            progress_events.publish(user_id, doc_id, 'extract', 'started')
+
+            if document.file_type == 'link':
+                source = document.content
+            else:
+                # Files are stored by name under the upload folder
+                source = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+
+            # Identical file bytes were already extracted and structured: reuse the result
+            if document.file_type != 'link':
+                content_hash = extraction_cache.file_digest(source)
+                cached = extraction_cache.lookup(content_hash)
+                if cached:
+                    logging.info(f"Extraction cache hit for document {doc_id}")
+                    progress_events.publish(user_id, doc_id, 'extract', 'completed', cached=True)
+                    return {
+                        'doc_id': doc_id,
+                        'user_id': user_id,
+                        'lock_token': lock_token,
+                        'raw_text': cached.raw_text,
+                        'structured_content': cached.structured_content,
+                    }
             else:
+                content_hash = None
+
+            raw_text = doc_processor.extract_text(document.file_type, source)
+            if not raw_text:
+                logging.error(f"No text extracted from document {doc_id}")
+                progress_events.publish(user_id, doc_id, 'extract', 'failed')
+                return None
+
+            progress_events.publish(user_id, doc_id, 'extract', 'completed')
+            return {
+                'doc_id': doc_id,
+                'user_id': user_id,
+                'lock_token': lock_token,
+                'raw_text': raw_text,
+                'content_hash': content_hash,
+            }
+
+    except Exception as e:
+        logging.error(f"Error extracting document {doc_id}: {str(e)}", exc_info=True)
+        if user_id is not None:
+            progress_events.publish(user_id, doc_id, 'extract', 'failed')
+        raise
+
+@celery.task
+def chunk_document_task(payload):
+    """Stage 2 (CPU): split raw text into persisted chunks"""
+    if not payload or not _pipeline_active(payload['doc_id'], payload['lock_token']):
+        return None
+    try:
+        from app import app
+        with app.app_context():
+            document = Document.query.get(payload['doc_id'])
+            progress_events.publish(payload['user_id'], payload['doc_id'], 'chunk', 'started')
+            doc_processor.save_chunks(document, doc_processor.chunk_text(payload['raw_text']))
+
+            if payload.get('structured_content'):
+                # Cached result: later stages no longer need the raw text on the broker
+                payload = {key: value for key, value in payload.items() if key != 'raw_text'}
+            progress_events.publish(payload['user_id'], payload['doc_id'], 'chunk', 'completed',
+                                    chunks=len(document.chunks))
+            return payload
+
+    except Exception as e:
+        logging.error(f"Error chunking document {payload['doc_id']}: {str(e)}", exc_info=True)
+        progress_events.publish(payload['user_id'], payload['doc_id'], 'chunk', 'failed')
+        raise
+
+@celery.task
+def structure_document_task(payload):
+    """Stage 3 (IO): generate structured study content with the LLM"""
+    if not payload or not _pipeline_active(payload['doc_id'], payload['lock_token']):
+        return None
+    doc_id, user_id = payload['doc_id'], payload['user_id']
+    try:
+        from app import app
+        with app.app_context():
+            document = Document.query.get(doc_id)
+            if document.processed:
+                # Redelivered after the result was committed; don't pay for the LLM twice
+                return {'doc_id': doc_id, 'user_id': user_id, 'lock_token': payload['lock_token']}
+            progress_events.publish(user_id, doc_id, 'structure', 'started')
+
+            structured_content = payload.get('structured_content')
+            if not structured_content:
+                chunks = [{'content': chunk.content, 'token_count': chunk.token_count} for chunk in document.chunks]
+                structured_content = doc_processor.structure_text(payload['raw_text'], chunks)
+                if structured_content and payload.get('content_hash'):
+                    extraction_cache.store(payload['content_hash'], document.file_type,
+                                           payload['raw_text'], structured_content)
+
+            if not structured_content:
                 logging.error(f"Failed to process document {doc_id}")
+                progress_events.publish(user_id, doc_id, 'structure', 'failed')
+                return None
+
+            content_dict = json.loads(structured_content)
+            document.structured_content = structured_content
+            document.category = content_dict.get('category', 'Uncategorized')
+            document.processed = True
+            db.session.commit()
+            logging.info(f"Successfully processed document {doc_id}")
+            # The document is usable from here on; indexing only affects chat retrieval
+            progress_events.publish(user_id, doc_id, 'structure', 'completed',
+                                    processed=True, category=document.category)
+            return {'doc_id': doc_id, 'user_id': user_id, 'lock_token': payload['lock_token']}
 
     except Exception as e:
-        logging.error(f"Error processing document {doc_id}: {str(e)}", exc_info=True)
+        logging.error(f"Error structuring document {doc_id}: {str(e)}", exc_info=True)
+        progress_events.publish(user_id, doc_id, 'structure', 'failed')
         raise
 
+@celery.task
+def index_document_task(payload):
+    """Stage 4 (IO): add the processed document to its owner's retrieval index"""
+    if not payload or not _pipeline_active(payload['doc_id'], payload['lock_token']):
+        return None
+    try:
+        from app import app
+        with app.app_context():
+            import vector_index
+            progress_events.publish(payload['user_id'], payload['doc_id'], 'index', 'started')
+            vector_index.index_document(Document.query.get(payload['doc_id']))
+            progress_events.publish(payload['user_id'], payload['doc_id'], 'index', 'completed', processed=True)
+            return payload
+
+    except Exception as e:
+        logging.error(f"Error indexing document {payload['doc_id']}: {str(e)}", exc_info=True)
+        progress_events.publish(payload['user_id'], payload['doc_id'], 'index', 'failed', processed=True)
+        raise
+
+@celery.task
+def release_document_lock_task(doc_id, lock_token):
+    """Final link of a pipeline: let the document be processed again"""
+    task_locks.release(_document_lock(doc_id), lock_token)
+
 @celery.task
 def combine_documents_task(doc_ids, user_id):
-    """Combine documents in background"""
+    """Combine documents in background, once per distinct set of document versions"""
     try:
         from app import app
         with app.app_context():
             documents = Document.query.filter(Document.id.in_(doc_ids)).all()
-            combined_content = doc_processor.combine_documents(documents)
-            return combined_content
+            cache_key = combine_cache_key(documents)
+            cached = get_cached_data(cache_key)
+            if cached is not None:
+                logging.info(f"Reusing combined content for documents {sorted(doc_ids)}")
+                return cached
+
+            lock_token = task_locks.acquire(cache_key, COMBINE_LOCK_TTL)
+            if not lock_token:
+                # The same combination is already running: wait for its result instead of redoing it
+                cached = task_locks.wait_for(lambda: get_cached_data(cache_key), COMBINE_LOCK_TTL)
+                if cached is not None:
+                    return cached
+
+            try:
+                combined_content = doc_processor.combine_documents(documents)
+                if combined_content:
+                    cache_data(cache_key, combined_content, COMBINE_CACHE_TTL)
+                return combined_content
+            finally:
+                if lock_token:
+                    task_locks.release(cache_key, lock_token)
 
     except Exception as e:
         logging.error(f"Error combining documents: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+
+@celery.task
+def grade_answer_task(practice_id):
+    """Transcribe a recorded interview answer if needed, then grade it"""
+    try:
+        from app import app
+        with app.app_context():
+            from ai_helper import generate_answer_feedback
+            import blob_store
+
+            practice = InterviewPractice.query.get(practice_id)
+            if not practice:
+                logging.error(f"Interview practice {practice_id} not found")
+                return
+            if practice.status == 'completed':
+                return  # Redelivered after it already finished
+
+            # Serialize redeliveries of the same job
+            lock_token = task_locks.acquire(f"practice:{practice_id}", GRADING_LOCK_TTL)
+            if not lock_token:
+                logging.info(f"Interview practice {practice_id} is already being graded, skipping duplicate")
+                return
+
+            try:
+                practice.status = 'processing'
+                db.session.commit()
+                progress_events.publish_job('practice', practice.user_id, practice_id, 'processing')
+
+                transcript = None
+                if practice.answer_type in ['audio', 'video'] and live_recording.exists(practice_id):
+                    transcript = _stitch_live_transcript(practice_id)
+                elif practice.answer_type in ['audio', 'video'] and not practice.user_answer:
+                    try:
+                        # Audio only, down-sampled and split at pauses for parallel transcription
+                        transcript = media_helper.transcribe_media(blob_store.blob_path(practice.media_url))
+                        logging.info(f"Transcribed answer for practice {practice_id}")
+                    except Exception as e:
+                        logging.error(f"Error transcribing audio: {str(e)}")
+                        practice.user_answer = f"[{practice.answer_type.upper()} Response - Transcription Failed]"
+                if transcript:
+                    practice.user_answer = transcript['text']
+                db.session.commit()
+
+                # Delivery is measured locally from word timings; the model only sees it as context
+                metrics = speech_metrics.compute_metrics(transcript['words']) if transcript else None
+
+                feedback = generate_answer_feedback(
+                    practice.question, practice.user_answer, practice.answer_type, practice.attempt_number,
+                    speech_metrics=metrics)
+
+                practice.score = feedback['score']
+                practice.ai_feedback = feedback['feedback']
+                if metrics:
+                    practice.confidence_score = metrics['confidence_score']
+                practice.status = 'completed'
+                db.session.commit()
+
+                progress_events.publish_job('practice', practice.user_id, practice_id, 'completed', feedback={
+                    'score': practice.score,
+                    'feedback': practice.ai_feedback,
+                    'confidence_score': practice.confidence_score if practice.answer_type in ['audio', 'video'] else None,
+                    'attempt_number': practice.attempt_number
+                })
+                if live_recording.exists(practice_id):
+                    live_recording.discard(practice_id)
+            except Exception as e:
+                db.session.rollback()
+                practice.status = 'failed'
+                practice.ai_feedback = f"Failed to generate AI feedback: {str(e)}"
+                db.session.commit()
+                progress_events.publish_job('practice', practice.user_id, practice_id, 'failed',
+                                            error=practice.ai_feedback)
+                raise
+            finally:
+                task_locks.release(f"practice:{practice_id}", lock_token)
+
+    except Exception as e:
+        logging.error(f"Error grading interview practice {practice_id}: {str(e)}", exc_info=True)
+        raise
+
+def _transcribe_span(practice_id, start, end, prompt=None):
+    """Cut one span out of a live recording and transcribe it"""
+    import blob_store
+    os.makedirs(blob_store.TMP_DIR, exist_ok=True)
+    segment_path = os.path.join(blob_store.TMP_DIR, f"segment_{practice_id}_{start:.0f}.webm")
+    try:
+        media_helper.cut_audio_segment(live_recording.recording_path(practice_id), segment_path, start, end)
+        # Word times are shifted onto the whole recording's clock for the speech metrics
+        return media_helper.transcribe_file(segment_path, prompt=prompt, offset=start)
+    finally:
+        if os.path.exists(segment_path):
+            os.remove(segment_path)
+
+def _stitch_live_transcript(practice_id):
+    """Join a live recording's segment transcripts, filling in any that never arrived"""
+    transcripts = []
+    for index, (start, end) in enumerate(live_recording.segments(practice_id)):
+        transcript = task_locks.wait_for(lambda: live_recording.segment_transcript(practice_id, index),
+                                         SEGMENT_RESULT_WAIT_SECONDS)
+        if transcript is None:
+            logging.warning(f"Segment {index} of practice {practice_id} missing, transcribing it now")
+            transcript = _transcribe_span(practice_id, start, end,
+                                          prompt=transcripts[-1]['text'] if transcripts else None)
+        transcripts.append(transcript)
+    return media_helper.stitch_transcripts(transcripts)
+
+@celery.task
+def transcribe_segment_task(practice_id, segment_index, start, end):
+    """Transcribe one span of an answer while the user is still recording"""
+    try:
+        if live_recording.segment_transcript(practice_id, segment_index) is not None:
+            return  # Redelivered after it already finished
+
+        previous = None
+        if segment_index:
+            # Continue from the previous segment so words and names carry across the cut
+            previous = task_locks.wait_for(
+                lambda: live_recording.segment_transcript(practice_id, segment_index - 1),
+                SEGMENT_PROMPT_WAIT_SECONDS)
+        transcript = _transcribe_span(practice_id, start, end, prompt=previous['text'] if previous else None)
+        live_recording.store_segment_transcript(practice_id, segment_index, transcript)
+
+    except Exception as e:
+        logging.error(f"Error transcribing segment {segment_index} of practice {practice_id}: {str(e)}",
+                      exc_info=True)
+        raise
+
+@celery.task
+def top_up_question_bank_task(posting_id):
+    """Generate more questions for a banked job posting so later requests are served from the bank"""
+    lock_name = f"question_bank:{posting_id}"
+    lock_token = task_locks.acquire(lock_name, QUESTION_BANK_LOCK_TTL)
+    if not lock_token:
+        return  # Another top-up for this posting is already running
+    try:
+        from app import app
+        from ai_helper import generate_interview_questions
+        with app.app_context():
+            posting = QuestionBankPosting.query.get(posting_id)
+            if not posting:
+                return
+            questions = generate_interview_questions(posting.job_description, count=question_bank.QUESTION_BANK_TOP_UP_SIZE)
+            banked = question_bank.add_questions(posting, questions)
+            logging.info(f"Topped up question bank posting {posting_id} with {len(banked)} questions")
+    except Exception as e:
+        logging.error(f"Error topping up question bank posting {posting_id}: {str(e)}", exc_info=True)
+        raise
+    finally:
+        task_locks.release(lock_name, lock_token)
@@ -1,16 +1,86 @@
 import os
+import re
+import hashlib
 import logging
-from typing import Optional, Dict, Any
-import requests
-from bs4 import BeautifulSoup
+from typing import Optional, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
 import json
-from extensions import openai_client  # Import the shared client
+from llm_gateway import llm_gateway, count_tokens  # All OpenAI calls go through the gateway
 from ocr_helper import extract_text_from_image
+from pdf_helper import extract_pdf_text
+from link_fetcher import link_fetcher
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Chunk sizing for retrieval and summarization
+CHUNK_MAX_TOKENS = int(os.environ.get('CHUNK_MAX_TOKENS', 400))
+
+# Lines that look like section headings: markdown, upper case (with at least one letter, so page
+# numbers don't count) or colon-terminated titles
+HEADING_PATTERN = re.compile(r'^(#{1,6}\s+.+|(?=.*[A-Z])[A-Z0-9][A-Z0-9 ,&/()-]{2,80}|[A-Z][^.!?]{0,80}:)$')
+# Numbered lines are headings only when short, unpunctuated and not part of a list of siblings
+NUMBERED_PATTERN = re.compile(r'^(\d+(?:\.\d+)*)[.)]?\s+')
+NUMBERED_HEADING_PATTERN = re.compile(r'^\d+(\.\d+)*[.)]?\s+[A-Z][^.!?,;:]{0,60}$')
+NUMBERED_HEADING_MAX_WORDS = 8
+# Headings are repeated in every chunk of their section, so keep them short
+HEADING_MAX_CHARS = 120
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+# Documents above this size are summarized map-reduce style instead of in one call
+SINGLE_PASS_MAX_TOKENS = int(os.environ.get('SINGLE_PASS_MAX_TOKENS', 5000))
+MAP_WINDOW_TOKENS = int(os.environ.get('MAP_WINDOW_TOKENS', 2500))
+SUMMARY_MAX_PARALLEL = int(os.environ.get('SUMMARY_MAX_PARALLEL', 4))
+MAX_REDUCE_ROUNDS = 3
+
+STRUCTURE_PROMPT = """Analyze the provided content and create a structured study document with the following JSON format:
+{
+    "title": "Main topic or subject",
+    "summary": "Concise overview of the content",
+    "category": "DSA|System Design|Behavioral",
+    "difficulty_level": "beginner|intermediate|advanced",
+    "estimated_study_time": "Time in minutes",
+    "key_concepts": [
+        {
+            "name": "Concept name",
+            "description": "Brief explanation"
+        }
+    ],
+    "sections": [
+        {
+            "heading": "Section title",
+            "content": "Detailed explanation",
+            "key_points": ["Important points"],
+            "examples": ["Examples or code snippets"]
+        }
+    ],
+    "practice_questions": [
+        {
+            "question": "Study question",
+            "answer": "Detailed answer",
+            "explanation": "Why this answer is correct",
+            "difficulty": "easy|medium|hard"
+        }
+    ],
+    "additional_resources": [
+        {
+            "title": "Resource name",
+            "type": "article|video|tutorial",
+            "description": "Brief description"
+        }
+    ]
+}
+
+For category classification:
+- DSA: Content about data structures, algorithms, complexity analysis, coding patterns
+- System Design: Architecture, scalability, databases, distributed systems, design patterns
+- Behavioral: Soft skills, leadership, teamwork, project management, communication"""
+
+MAP_PROMPT = """Condense this part of a longer study document into compact notes for a later summarization step.
+Include: a 2-3 sentence summary, the key concepts with one-line explanations, important points,
+notable examples or code, and 1-2 practice question ideas. Use short bullet points and keep technical terms exact."""
+
 class DocumentProcessor:
     def __init__(self):
         self.supported_types = {
@@ -22,83 +92,244 @@ class DocumentProcessor:
     def process_document(self, doc_type: str, content: Any) -> Optional[str]:
         """Process a document and return structured content as JSON string"""
         try:
-            if doc_type not in self.supported_types:
-                raise ValueError(f"Unsupported document type: {doc_type}")
-
-            logger.debug(f"Processing document of type: {doc_type}")
-
-            # Extract raw text content
-            raw_text = self.supported_types[doc_type](content)
+            raw_text = self.extract_text(doc_type, content)
             if not raw_text:
                 logger.warning(f"No text content extracted from {doc_type} document")
                 return None
 
-            # Generate structured content using OpenAI
-            response = openai_client.chat.completions.create(
-                model="gpt-4",  # Using standard gpt-4 model
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """Analyze the provided content and create a structured study document with the following JSON format:
-                        {
-                            "title": "Main topic or subject",
-                            "summary": "Concise overview of the content",
-                            "category": "DSA|System Design|Behavioral",
-                            "difficulty_level": "beginner|intermediate|advanced",
-                            "estimated_study_time": "Time in minutes",
-                            "key_concepts": [
-                                {
-                                    "name": "Concept name",
-                                    "description": "Brief explanation"
-                                }
-                            ],
-                            "sections": [
-                                {
-                                    "heading": "Section title",
-                                    "content": "Detailed explanation",
-                                    "key_points": ["Important points"],
-                                    "examples": ["Examples or code snippets"]
-                                }
-                            ],
-                            "practice_questions": [
-                                {
-                                    "question": "Study question",
-                                    "answer": "Detailed answer",
-                                    "explanation": "Why this answer is correct",
-                                    "difficulty": "easy|medium|hard"
-                                }
-                            ],
-                            "additional_resources": [
-                                {
-                                    "title": "Resource name",
-                                    "type": "article|video|tutorial",
-                                    "description": "Brief description"
-                                }
-                            ]
-                        }
+            return self.structure_text(raw_text)
 
-                        For category classification:
-                        - DSA: Content about data structures, algorithms, complexity analysis, coding patterns
-                        - System Design: Architecture, scalability, databases, distributed systems, design patterns
-                        - Behavioral: Soft skills, leadership, teamwork, project management, communication
-                        """
-                    },
-                    {"role": "user", "content": raw_text}
-                ]
-            )
+        except Exception as e:
+            logger.error(f"Error processing document: {str(e)}", exc_info=True)
+            return None
 
-            structured_content = json.loads(response.choices[0].message.content)
-            return json.dumps(structured_content)
+    def extract_text(self, doc_type: str, content: Any) -> Optional[str]:
+        """Extract raw text from a document source"""
+        if doc_type not in self.supported_types:
+            raise ValueError(f"Unsupported document type: {doc_type}")
+
+        logger.debug(f"Processing document of type: {doc_type}")
+        return self.supported_types[doc_type](content)
+
+    def chunk_text(self, text: str, max_tokens: int = CHUNK_MAX_TOKENS) -> List[Dict[str, Any]]:
+        """Split text on section and paragraph boundaries into chunks of at most max_tokens"""
+        chunks = []
+
+        def assemble(prefix, parts):
+            # Repeat the heading in every chunk so each one stands alone in retrieval
+            return prefix + '\n\n'.join(parts).strip()
+
+        def emit(heading, prefix, parts):
+            if not any(part.strip() for part in parts):
+                return
+            body = assemble(prefix, parts)
+            chunks.append({
+                'heading': heading,
+                'content': body,
+                'token_count': count_tokens(body),
+                'content_hash': hashlib.sha256(body.encode('utf-8')).hexdigest()
+            })
+
+        for heading, paragraphs in self._split_sections(text):
+            prefix = f"{heading}\n\n" if heading else ''
+            # One token of slack: counts are not exactly additive across the join
+            budget = max_tokens - count_tokens(prefix) - 1 if prefix else max_tokens
+            if budget < max_tokens // 2:
+                # Too long to repeat in every chunk; it is still stored as the chunk heading
+                prefix, budget = '', max_tokens
+            current = []
+            for paragraph in paragraphs:
+                for piece in self._split_oversized(paragraph, budget):
+                    if current and count_tokens(assemble(prefix, current + [piece])) > max_tokens:
+                        emit(heading, prefix, current)
+                        current = []
+                    current.append(piece)
+            emit(heading, prefix, current)
+
+        for index, chunk in enumerate(chunks):
+            chunk['chunk_index'] = index
+        return chunks
+
+    def save_chunks(self, document, chunks: List[Dict[str, Any]]) -> None:
+        """Persist chunks for a document, keeping rows whose content hash is unchanged"""
+        from models import DocumentChunk, db
+
+        existing = {chunk.content_hash: chunk for chunk in DocumentChunk.query.filter_by(document_id=document.id)}
+        seen = set()
+        for chunk in chunks:
+            if chunk['content_hash'] in seen:
+                continue  # Identical text repeated within a document is stored once
+            seen.add(chunk['content_hash'])
+
+            row = existing.pop(chunk['content_hash'], None)
+            if row:
+                row.chunk_index = chunk['chunk_index']
+                row.heading = chunk['heading']
+            else:
+                db.session.add(DocumentChunk(document_id=document.id, **chunk))
+
+        for stale in existing.values():
+            db.session.delete(stale)
+        db.session.commit()
+        logger.debug(f"Saved {len(seen)} chunks for document {document.id}")
+
+    def _split_sections(self, text: str):
+        """Yield (heading, paragraphs) pairs, starting a new section at each heading line"""
+        heading, parent, paragraphs, lines = None, None, [], []
+
+        def flush_paragraph():
+            if lines:
+                paragraphs.append(' '.join(lines))
+                lines.clear()
+
+        text_lines = [line.strip() for line in text.splitlines()]
+        non_blank = [line for line in text_lines if line]
+        position = 0
+        for line in text_lines:
+            if not line:
+                flush_paragraph()
+                continue
+            previous = non_blank[position - 1] if position else None
+            following = non_blank[position + 1] if position + 1 < len(non_blank) else None
+            position += 1
+
+            if self._is_heading(line, previous, following):
+                flush_paragraph()
+                title = line.lstrip('#').strip().rstrip(':')[:HEADING_MAX_CHARS]
+                if not paragraphs and heading:
+                    # Consecutive headings: keep the last one under its immediate parent at most,
+                    # so runs such as a table of contents don't pile up into one heading
+                    heading = f"{parent} - {title}"[:HEADING_MAX_CHARS]
+                    parent = title
+                    continue
+                if paragraphs:
+                    yield heading, paragraphs
+                heading, parent, paragraphs = title, title, []
+            else:
+                lines.append(line)
+
+        flush_paragraph()
+        if paragraphs:
+            yield heading, paragraphs
+
+    def _is_heading(self, line: str, previous: Optional[str], following: Optional[str]) -> bool:
+        """Whether a line starts a section, given its neighbouring non-blank lines"""
+        numbered = NUMBERED_PATTERN.match(line)
+        if not numbered:
+            return bool(HEADING_PATTERN.match(line)) and len(line.split()) <= 12
+
+        if not NUMBERED_HEADING_PATTERN.match(line) or len(line.split()) > NUMBERED_HEADING_MAX_WORDS:
+            return False
+        # "1. Install" directly followed by "2. Configure" is a list, not two sections
+        depth = numbered.group(1).count('.')
+        for neighbour in (previous, following):
+            sibling = NUMBERED_PATTERN.match(neighbour or '')
+            if sibling and sibling.group(1).count('.') == depth:
+                return False
+        return True
+
+    def _split_oversized(self, paragraph: str, max_tokens: int) -> List[str]:
+        """Break a paragraph that exceeds max_tokens on sentence, then word, boundaries"""
+        if count_tokens(paragraph) <= max_tokens:
+            return [paragraph]
+
+        pieces, current = [], ''
+        for sentence in SENTENCE_PATTERN.split(paragraph):
+            words = [sentence] if count_tokens(sentence) <= max_tokens else sentence.split()
+            for unit in words:
+                candidate = f"{current} {unit}".strip()
+                if current and count_tokens(candidate) > max_tokens:
+                    pieces.append(current)
+                    candidate = unit
+                current = candidate
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def structure_text(self, raw_text: str, chunks: Optional[List[Dict[str, Any]]] = None) -> Optional[str]:
+        """Turn extracted text into the structured study document JSON string"""
+        try:
+            if count_tokens(raw_text) <= SINGLE_PASS_MAX_TOKENS:
+                return self._structure(raw_text)
+
+            # Map: condense windows of chunks in parallel; reduce: structure the combined notes
+            notes = self._summarize_chunks(chunks or self.chunk_text(raw_text))
+            for _ in range(MAX_REDUCE_ROUNDS):
+                if count_tokens(notes) <= SINGLE_PASS_MAX_TOKENS:
+                    break
+                notes = self._summarize_chunks(self.chunk_text(notes))
+
+            return self._structure(
+                "The following are study notes covering consecutive parts of one long document:\n\n" + notes)
 
         except Exception as e:
             logger.error(f"Error processing document: {str(e)}", exc_info=True)
             return None
 
-    def process_pdf(self, content: str) -> Optional[str]:
-        """Process PDF content - placeholder for PDF processing"""
-        # TODO: Implement PDF processing
-        logger.warning("PDF processing not yet implemented")
-        return content
+    def _structure(self, text: str) -> str:
+        """Single structuring call producing the study document schema"""
+        # Generate structured content using OpenAI
+        response = llm_gateway.chat_completion(
+            model="gpt-4",  # Using standard gpt-4 model
+            messages=[
+                {"role": "system", "content": STRUCTURE_PROMPT},
+                {"role": "user", "content": text}
+            ],
+            timeout=180  # Long structured outputs need a wider deadline than chat
+        )
+
+        structured_content = json.loads(response.choices[0].message.content)
+        return json.dumps(structured_content)
+
+    def _summarize_chunks(self, chunks: List[Dict[str, Any]]) -> str:
+        """Summarize windows of consecutive chunks concurrently and join the notes in order"""
+        windows, current, current_tokens = [], [], 0
+        for chunk in chunks:
+            if current and current_tokens + chunk['token_count'] > MAP_WINDOW_TOKENS:
+                windows.append('\n\n'.join(current))
+                current, current_tokens = [], 0
+            current.append(chunk['content'])
+            current_tokens += chunk['token_count']
+        if current:
+            windows.append('\n\n'.join(current))
+
+        logger.debug(f"Summarizing {len(windows)} windows with up to {SUMMARY_MAX_PARALLEL} in parallel")
+        with ThreadPoolExecutor(max_workers=max(1, min(SUMMARY_MAX_PARALLEL, len(windows)))) as executor:
+            notes = list(executor.map(self._summarize_window, windows))
+
+        notes = [note for note in notes if note]
+        if not notes:
+            raise ValueError("Failed to summarize any part of the document")
+        return '\n\n'.join(f"Part {i + 1}:\n{note}" for i, note in enumerate(notes))
+
+    def _summarize_window(self, text: str) -> Optional[str]:
+        """Map step: condense one window of source text into study notes"""
+        try:
+            response = llm_gateway.chat_completion(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": MAP_PROMPT},
+                    {"role": "user", "content": text}
+                ],
+                temperature=0.3,
+                max_tokens=700,
+                timeout=120
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            # A missing part degrades the summary; it should not fail the whole document
+            logger.error(f"Error summarizing document window: {str(e)}")
+            return None
+
+    def process_pdf(self, pdf_path: str) -> Optional[str]:
+        """Extract PDF text page by page, OCR'ing only pages without a text layer"""
+        try:
+            logger.debug(f"Processing PDF: {pdf_path}")
+            text, stats = extract_pdf_text(pdf_path)
+            return text
+        except Exception as e:
+            logger.error(f"Error processing PDF: {str(e)}")
+            return None
 
     def process_image(self, image_path: str) -> Optional[str]:
         """Process image using OCR"""
@@ -109,31 +340,7 @@ class DocumentProcessor:
         """Process web link content"""
         try:
             logger.debug(f"Processing link: {url}")
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Extract main content (adjust selectors based on common website structures)
-            content = []
-            main_selectors = ['article', 'main', '#content', '.content', '.post-content']
-
-            # Try to find main content container
-            main_content = None
-            for selector in main_selectors:
-                main_content = soup.select_one(selector)
-                if main_content:
-                    break
-
-            # If main content container found, extract from it, otherwise use body
-            target = main_content if main_content else soup
-
-            # Extract text from paragraphs and headings
-            for tag in target.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-                text = tag.get_text().strip()
-                if text:  # Only add non-empty strings
-                    content.append(text)
-
-            return ' '.join(content)
+            return link_fetcher.fetch(url)
         except Exception as e:
             logger.error(f"Error processing link: {str(e)}")
             return None
@@ -160,7 +367,7 @@ class DocumentProcessor:
             combined_text = "\n".join(combined_content)
 
             # Generate new structured content from combined documents
-            response = openai_client.chat.completions.create(
+            response = llm_gateway.chat_completion(
                 model="gpt-4",
                 messages=[
                     {
@@ -209,7 +416,8 @@ class DocumentProcessor:
                         "role": "user",
                         "content": combined_text
                     }
-                ]
+                ],
+                timeout=180
             )
 
             return json.loads(response.choices[0].message.content)
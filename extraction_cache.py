@@ -0,0 +1,71 @@
+import hashlib
+import logging
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from cache_helper import redis_client
+from models import ExtractionCache, db
+
+# Bump whenever extraction or structuring changes so stale results are not reused
+EXTRACTOR_VERSION = '1'
+
+STATS_KEY = 'extraction_cache:stats'
+
+def file_digest(path):
+    """SHA-256 of a file's bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _count(field):
+    try:
+        redis_client.hincrby(STATS_KEY, field, 1)
+    except Exception as e:
+        logging.error(f"Extraction cache stats error: {str(e)}")
+
+def lookup(content_hash):
+    """Return the cached extraction for these file bytes, or None"""
+    entry = ExtractionCache.query.filter_by(
+        content_hash=content_hash,
+        extractor_version=EXTRACTOR_VERSION
+    ).first()
+
+    if not entry:
+        _count('misses')
+        return None
+
+    _count('hits')
+    entry.hit_count = (entry.hit_count or 0) + 1
+    entry.last_hit_at = datetime.utcnow()
+    db.session.commit()
+    return entry
+
+def store(content_hash, file_type, raw_text, structured_content):
+    """Remember an extraction; a concurrent insert of the same bytes is harmless"""
+    try:
+        db.session.add(ExtractionCache(
+            content_hash=content_hash,
+            extractor_version=EXTRACTOR_VERSION,
+            file_type=file_type,
+            raw_text=raw_text,
+            structured_content=structured_content
+        ))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+
+def stats():
+    """Hit and miss counters across all workers"""
+    try:
+        counters = {k.decode(): int(v) for k, v in redis_client.hgetall(STATS_KEY).items()}
+    except Exception as e:
+        logging.error(f"Extraction cache stats error: {str(e)}")
+        counters = {}
+    hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        'entries': ExtractionCache.query.count(),
+    }
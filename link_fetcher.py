@@ -0,0 +1,152 @@
+import os
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, List
+from urllib.parse import urlsplit
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import trafilatura
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cache_helper import cache_data, get_cached_data, get_many
+
+logger = logging.getLogger(__name__)
+
+# Ingestion settings, overridable per deployment
+LINK_MAX_BYTES = int(os.environ.get('LINK_MAX_BYTES', 5 * 1024 * 1024))
+LINK_CONNECT_TIMEOUT = float(os.environ.get('LINK_CONNECT_TIMEOUT', 5))
+LINK_READ_TIMEOUT = float(os.environ.get('LINK_READ_TIMEOUT', 10))
+LINK_MAX_WORKERS = int(os.environ.get('LINK_MAX_WORKERS', 8))
+LINK_PER_HOST_CONCURRENCY = int(os.environ.get('LINK_PER_HOST_CONCURRENCY', 2))
+LINK_CACHE_TTL_SECONDS = int(os.environ.get('LINK_CACHE_TTL_SECONDS', 7 * 86400))
+
+TEXT_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+def _cache_key(url):
+    return f"link:{hashlib.sha256(url.encode('utf-8')).hexdigest()}"
+
+class LinkFetcher:
+    """Fetch web pages over pooled sessions with revalidation, a byte cap and per-host limits"""
+
+    def __init__(self):
+        retry = Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504], allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=LINK_MAX_WORKERS, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = 'AceItAI/1.0 (+study material ingestion)'
+
+        # host -> [semaphore, fetches holding or waiting for it]; dropped when the count reaches 0,
+        # so only hosts being fetched right now take memory
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+
+    def fetch(self, url: str) -> Optional[str]:
+        """Return the main text of a page, revalidating a cached copy when possible"""
+        return self._fetch(url, get_cached_data(_cache_key(url)))
+
+    def _fetch(self, url: str, cached: Optional[dict]) -> Optional[str]:
+        cache_key = _cache_key(url)
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        with self._slot(url):
+            with self.session.get(url, headers=headers, stream=True,
+                                  timeout=(LINK_CONNECT_TIMEOUT, LINK_READ_TIMEOUT)) as response:
+                if response.status_code == 304 and cached:
+                    logger.debug(f"Link not modified, reusing cached text: {url}")
+                    cache_data(cache_key, cached, LINK_CACHE_TTL_SECONDS)
+                    return cached['text']
+
+                response.raise_for_status()
+                content_type = response.headers.get('Content-Type', 'text/html').split(';')[0].strip().lower()
+                if content_type not in TEXT_CONTENT_TYPES:
+                    raise ValueError(f"Unsupported content type for link: {content_type}")
+
+                body = self._read_capped(response, url)
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+
+        text = body.decode('utf-8', errors='replace') if content_type == 'text/plain' else self.extract(body, url)
+        if text and (etag or last_modified):
+            cache_data(cache_key, {'etag': etag, 'last_modified': last_modified, 'text': text},
+                       LINK_CACHE_TTL_SECONDS)
+        return text
+
+    def fetch_many(self, urls: List[str]) -> Dict[str, Optional[str]]:
+        """Fetch a batch of URLs concurrently; per-host limits still apply"""
+        # One cache round trip for the whole batch rather than one per URL
+        cached = get_many([_cache_key(url) for url in urls])
+
+        def fetch_or_none(url):
+            try:
+                return self._fetch(url, cached.get(_cache_key(url)))
+            except Exception as e:
+                logger.error(f"Error fetching link {url}: {str(e)}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(LINK_MAX_WORKERS, len(urls)))) as executor:
+            return dict(zip(urls, executor.map(fetch_or_none, urls)))
+
+    def extract(self, html: bytes, url: str) -> Optional[str]:
+        """Extract main content with trafilatura, falling back to heading/paragraph scraping"""
+        text = trafilatura.extract(html, url=url, include_comments=False, include_tables=True)
+        if text:
+            return text
+        return self._extract_fallback(html)
+
+    def _extract_fallback(self, html: bytes) -> Optional[str]:
+        soup = BeautifulSoup(html, 'lxml')
+
+        # Extract main content (adjust selectors based on common website structures)
+        main_content = None
+        for selector in ['article', 'main', '#content', '.content', '.post-content']:
+            main_content = soup.select_one(selector)
+            if main_content:
+                break
+
+        # If main content container found, extract from it, otherwise use body
+        target = main_content if main_content else soup
+        content = [tag.get_text().strip() for tag in target.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])]
+        return '\n'.join(text for text in content if text) or None
+
+    def _read_capped(self, response, url) -> bytes:
+        """Read the streamed body, stopping at LINK_MAX_BYTES"""
+        declared = response.headers.get('Content-Length')
+        if declared and declared.isdigit() and int(declared) > LINK_MAX_BYTES:
+            logger.warning(f"Link body of {declared} bytes exceeds cap, truncating: {url}")
+
+        chunks, size = [], 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= LINK_MAX_BYTES:
+                logger.warning(f"Stopped reading link after {size} bytes: {url}")
+                break
+        return b''.join(chunks)[:LINK_MAX_BYTES]
+
+    @contextmanager
+    def _slot(self, url):
+        """Hold one of the host's LINK_PER_HOST_CONCURRENCY fetch slots"""
+        host = urlsplit(url).netloc.lower()
+        with self._host_lock:
+            slot = self._host_slots.setdefault(host, [threading.BoundedSemaphore(LINK_PER_HOST_CONCURRENCY), 0])
+            slot[1] += 1
+        try:
+            with slot[0]:
+                yield
+        finally:
+            with self._host_lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._host_slots[host]
+
+# Shared fetcher for the process
+link_fetcher = LinkFetcher()
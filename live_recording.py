@@ -0,0 +1,135 @@
+import os
+import json
+import fcntl
+import logging
+import blob_store
+from cache_helper import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Recording settings, overridable per deployment
+SEGMENT_SECONDS = float(os.environ.get('RECORDING_SEGMENT_SECONDS', 20))
+RECORDING_MAX_SECONDS = float(os.environ.get('RECORDING_MAX_SECONDS', 900))
+SEGMENT_TEXT_TTL_SECONDS = 86400
+
+RECORDING_DIR = os.path.join(blob_store.UPLOAD_ROOT, 'recordings')
+
+class ChunkOrderError(ValueError):
+    """A chunk arrived out of sequence; expected says which index the server needs next"""
+
+    def __init__(self, expected):
+        super().__init__(f"Expected chunk {expected}")
+        self.expected = expected
+
+def exists(practice_id):
+    """Whether an answer was streamed in while recording rather than uploaded whole"""
+    return os.path.exists(_state_path(practice_id))
+
+def recording_path(practice_id):
+    return os.path.join(RECORDING_DIR, f"{practice_id}.webm")
+
+def _state_path(practice_id):
+    return os.path.join(RECORDING_DIR, f"{practice_id}.json")
+
+def _segments_key(practice_id):
+    return f"recording:{practice_id}:segments"
+
+def _read_state(practice_id):
+    with open(_state_path(practice_id)) as state_file:
+        return json.load(state_file)
+
+def _write_state(practice_id, state):
+    tmp_path = _state_path(practice_id) + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(tmp_path, _state_path(practice_id))
+
+def start(practice_id):
+    """Create an empty recording that chunks are appended to while the user answers"""
+    os.makedirs(RECORDING_DIR, exist_ok=True)
+    open(recording_path(practice_id), 'wb').close()
+    _write_state(practice_id, {'next_chunk': 0, 'recorded_seconds': 0.0, 'segments': [], 'finished': False})
+
+def append_chunk(practice_id, index, stream, length, recorded_seconds):
+    """Append MediaRecorder chunk `index`; returns (start, end, segment_index) spans now ready to transcribe"""
+    if length > blob_store.UPLOAD_CHUNK_BYTES:
+        raise ValueError(f"Chunks may be at most {blob_store.UPLOAD_CHUNK_BYTES} bytes")
+
+    with open(recording_path(practice_id), 'ab') as recording:
+        # One writer at a time, and the state file moves in step with the bytes
+        fcntl.flock(recording, fcntl.LOCK_EX)
+        state = _read_state(practice_id)
+        if state['finished']:
+            raise ValueError("Recording is already finished")
+        if index < state['next_chunk']:
+            return []  # A retried chunk the server already holds
+        if index > state['next_chunk']:
+            raise ChunkOrderError(state['next_chunk'])
+
+        data = stream.read(length)
+        if len(data) != length:
+            raise ChunkOrderError(state['next_chunk'])
+        recording.write(data)
+        recording.flush()
+
+        state['next_chunk'] += 1
+        state['recorded_seconds'] = min(max(state['recorded_seconds'], recorded_seconds), RECORDING_MAX_SECONDS)
+        ready = _cut_segments(state, final=False)
+        _write_state(practice_id, state)
+        return ready
+
+def finish(practice_id, recorded_seconds):
+    """Close the recording; returns (blob name of the full recording, last spans to transcribe, segment count)"""
+    with open(recording_path(practice_id), 'rb') as recording:
+        fcntl.flock(recording, fcntl.LOCK_EX)
+        state = _read_state(practice_id)
+        if not state['finished']:
+            state['recorded_seconds'] = min(max(state['recorded_seconds'], recorded_seconds), RECORDING_MAX_SECONDS)
+            ready = _cut_segments(state, final=True)
+            state['finished'] = True
+            _write_state(practice_id, state)
+        else:
+            ready = []
+
+    # Keep the working copy for the segment tasks; the blob store gets the finished recording
+    with open(recording_path(practice_id), 'rb') as recording:
+        name, _ = blob_store.save_stream(recording, '.webm')
+    return name, ready, len(state['segments'])
+
+def _cut_segments(state, final):
+    """Close every full SEGMENT_SECONDS span recorded so far, and the remainder when final"""
+    ready = []
+    segment_end = state['segments'][-1][1] if state['segments'] else 0.0
+    while state['recorded_seconds'] - segment_end >= SEGMENT_SECONDS:
+        span = (segment_end, segment_end + SEGMENT_SECONDS)
+        state['segments'].append(span)
+        ready.append((span[0], span[1], len(state['segments']) - 1))
+        segment_end = span[1]
+    if final and (state['recorded_seconds'] > segment_end or not state['segments']):
+        # Open-ended so audio past the client's clock is not lost
+        state['segments'].append((segment_end, None))
+        ready.append((segment_end, None, len(state['segments']) - 1))
+    return ready
+
+def segments(practice_id):
+    """All (start, end) spans of a recording, in order"""
+    return [tuple(span) for span in _read_state(practice_id)['segments']]
+
+def store_segment_transcript(practice_id, index, transcript):
+    key = _segments_key(practice_id)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(key, index, json.dumps(transcript))
+    pipe.expire(key, SEGMENT_TEXT_TTL_SECONDS)
+    pipe.execute()
+
+def segment_transcript(practice_id, index):
+    """Transcript of one segment ({'text', 'words'}), or None while it is still being transcribed"""
+    value = redis_client.hget(_segments_key(practice_id), index)
+    return json.loads(value) if value is not None else None
+
+def discard(practice_id):
+    """Remove the working copy and segment transcripts once the answer is graded"""
+    for path in (recording_path(practice_id), _state_path(practice_id)):
+        if os.path.exists(path):
+            os.remove(path)
+    redis_client.delete(_segments_key(practice_id))
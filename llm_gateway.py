@@ -0,0 +1,275 @@
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import openai
+from extensions import openai_client
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Gateway settings, overridable per deployment
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', 60))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))
+LLM_HEDGE_DELAY_SECONDS = float(os.environ.get('LLM_HEDGE_DELAY_SECONDS', 3))
+LLM_BREAKER_THRESHOLD = int(os.environ.get('LLM_BREAKER_THRESHOLD', 5))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('LLM_BREAKER_COOLDOWN_SECONDS', 30))
+# A half-open probe that has not reported back by then is presumed lost and another is let through
+LLM_BREAKER_PROBE_TIMEOUT_SECONDS = float(os.environ.get('LLM_BREAKER_PROBE_TIMEOUT_SECONDS', LLM_TIMEOUT_SECONDS))
+
+# Errors that indicate a degraded upstream and are worth retrying
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_encoding = None
+
+def count_tokens(text):
+    """Count model tokens, falling back to a 4-characters-per-token estimate without tiktoken"""
+    global _encoding
+    if tiktoken is not None:
+        try:
+            if _encoding is None:
+                _encoding = tiktoken.get_encoding('cl100k_base')
+            return len(_encoding.encode(text))
+        except Exception:
+            pass
+    return max(1, len(text) // 4)
+
+class LLMUnavailableError(Exception):
+    """Raised when the gateway fails fast or runs out of time or retries"""
+    pass
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open probe after a cooldown"""
+
+    # allow_request() returns this instead of True for the one call that probes a half-open upstream
+    PROBE = 'probe'
+
+    def __init__(self, failure_threshold=LLM_BREAKER_THRESHOLD, cooldown_seconds=LLM_BREAKER_COOLDOWN_SECONDS,
+                 probe_timeout_seconds=LLM_BREAKER_PROBE_TIMEOUT_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.probe_timeout_seconds = probe_timeout_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Return True if a call may go upstream right now, PROBE if that call is the half-open probe
+
+        Whoever receives PROBE must resolve it with record_success, record_failure or abandon_probe.
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if (self.state == 'open' and now - self.opened_at >= self.cooldown_seconds) or \
+                    (self.state == 'half_open' and now - self.probe_started_at >= self.probe_timeout_seconds):
+                # Let a single probe through to test the upstream
+                self.state = 'half_open'
+                self.probe_started_at = now
+                return self.PROBE
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"LLM circuit breaker opened after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def abandon_probe(self):
+        """The probe ended without a verdict (other error, timeout, disconnect): wait out another cooldown"""
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class LLMGateway:
+    """Single entry point for OpenAI calls with deadlines, retries, hedging and load shedding"""
+
+    def __init__(self, client, max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT_SECONDS,
+                 max_retries=LLM_MAX_RETRIES, hedge_delay=LLM_HEDGE_DELAY_SECONDS, breaker=None):
+        self.client = client
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix='llm-gateway')
+
+    def chat_completion(self, timeout=None, retries=None, hedge=False, **kwargs):
+        """Create a chat completion; hedge=True races a backup request for latency-critical calls"""
+        return self._call(
+            lambda client: client.chat.completions.create(**kwargs),
+            timeout, retries, hedge)
+
+    def embed(self, texts, model='text-embedding-3-small', timeout=10, retries=None):
+        """Return one embedding vector per input text"""
+        response = self._call(
+            lambda client: client.embeddings.create(model=model, input=texts),
+            timeout, retries, hedge=False)
+        return [item.embedding for item in response.data]
+
+    def transcribe(self, timeout=None, retries=None, **kwargs):
+        """Transcribe audio with Whisper through the gateway"""
+        audio_file = kwargs.get('file')
+
+        def attempt(client):
+            # Rewind so a retried upload sends the whole file again
+            if hasattr(audio_file, 'seek'):
+                audio_file.seek(0)
+            return client.audio.transcriptions.create(**kwargs)
+
+        return self._call(attempt, timeout, retries, hedge=False)
+
+    def stream_chat_completion(self, timeout=None, retries=None, **kwargs):
+        """Yield chat completion chunks; retries are only attempted before the first chunk arrives
+
+        The deadline covers the whole stream, not just each read, so an upstream that trickles
+        tokens can't hold a thread and a concurrency slot indefinitely.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        retries = self.max_retries if retries is None else retries
+
+        for attempt in range(retries + 1):
+            probe = self._acquire(deadline)
+            started = resolved = False
+            stream = None
+            try:
+                client = self.client.with_options(timeout=self._remaining(deadline), max_retries=0)
+                stream = client.chat.completions.create(stream=True, **kwargs)
+                for chunk in stream:
+                    if time.monotonic() >= deadline:
+                        self.breaker.record_failure()
+                        resolved = True
+                        raise LLMUnavailableError("LLM stream deadline exceeded")
+                    started = True
+                    yield chunk
+                self.breaker.record_success()
+                resolved = True
+                return
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                resolved = True
+                if started or attempt == retries:
+                    raise LLMUnavailableError(f"LLM stream failed: {e}") from e
+                logger.warning(f"Retrying LLM stream after error: {e}")
+            finally:
+                if stream is not None:
+                    stream.close()
+                self._slots.release()
+                # Any other exit, including the client closing the stream (GeneratorExit)
+                if probe and not resolved:
+                    self.breaker.abandon_probe()
+            self._backoff(attempt, deadline)
+
+    def _call(self, fn, timeout, retries, hedge):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        retries = self.max_retries if retries is None else retries
+
+        for attempt in range(retries + 1):
+            probe = self._acquire(deadline)
+            resolved = False
+            try:
+                if hedge:
+                    result = self._hedged_attempt(fn, deadline)
+                else:
+                    try:
+                        result = self._attempt(fn, deadline)
+                    finally:
+                        self._slots.release()
+                self.breaker.record_success()
+                resolved = True
+                return result
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                resolved = True
+                if attempt == retries:
+                    raise LLMUnavailableError(f"LLM request failed after {attempt + 1} attempts: {e}") from e
+                logger.warning(f"Retrying LLM request (attempt {attempt + 1}) after error: {e}")
+            finally:
+                if probe and not resolved:
+                    self.breaker.abandon_probe()
+            self._backoff(attempt, deadline)
+
+    def _attempt(self, fn, deadline):
+        client = self.client.with_options(timeout=self._remaining(deadline), max_retries=0)
+        return fn(client)
+
+    def _hedged_attempt(self, fn, deadline):
+        """Run a primary request on the slot the caller acquired and, if it is slow, race a backup against it"""
+        futures = [self._executor.submit(self._attempt_and_release, fn, deadline)]
+
+        done, _ = wait(futures, timeout=min(self.hedge_delay, self._remaining(deadline)))
+        # Only hedge when a slot is free; hedging must never add to a backlog
+        if not done and self._slots.acquire(blocking=False):
+            logger.debug("Issuing hedged LLM request")
+            futures.append(self._executor.submit(self._attempt_and_release, fn, deadline))
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=self._remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise LLMUnavailableError("LLM request deadline exceeded")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _attempt_and_release(self, fn, deadline):
+        try:
+            return self._attempt(fn, deadline)
+        finally:
+            self._slots.release()
+
+    def _acquire(self, deadline):
+        """Take a concurrency slot; returns True when this call is the breaker's half-open probe"""
+        allowed = self.breaker.allow_request()
+        if not allowed:
+            raise LLMUnavailableError("LLM upstream is degraded; circuit breaker is open")
+        probe = allowed == CircuitBreaker.PROBE
+        try:
+            if not self._slots.acquire(timeout=self._remaining(deadline)):
+                raise LLMUnavailableError("Timed out waiting for an LLM concurrency slot")
+        except BaseException:
+            if probe:
+                self.breaker.abandon_probe()
+            raise
+        return probe
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMUnavailableError("LLM request deadline exceeded")
+        return remaining
+
+    def _backoff(self, attempt, deadline):
+        """Sleep with full jitter, never past the call deadline"""
+        delay = random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+        time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+
+# Shared gateway for the process
+llm_gateway = LLMGateway(openai_client)
@@ -0,0 +1,138 @@
+import os
+import re
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from llm_gateway import llm_gateway
+
+logger = logging.getLogger(__name__)
+
+# Media settings, overridable per deployment
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+FFPROBE_BIN = os.environ.get('FFPROBE_BIN', 'ffprobe')
+FFMPEG_TIMEOUT_SECONDS = int(os.environ.get('FFMPEG_TIMEOUT_SECONDS', 120))
+# Whisper only honours the tail of a prompt, so carry over at most this much context
+PROMPT_MAX_CHARS = 800
+FILLER_PROMPT = "Umm, so, uh, I think, like, the answer is... hmm, let me, you know, explain."
+# Answers longer than this are split at pauses and transcribed in parallel
+MEDIA_SEGMENT_SECONDS = float(os.environ.get('MEDIA_SEGMENT_SECONDS', 90))
+MEDIA_MAX_PARALLEL = int(os.environ.get('MEDIA_MAX_PARALLEL', 4))
+SILENCE_THRESHOLD_DB = int(os.environ.get('SILENCE_THRESHOLD_DB', -40))
+SILENCE_MIN_SECONDS = 0.4
+
+# Speech only needs mono 16 kHz; Opus keeps that near 3 KB/s, far below Whisper's upload limit
+AUDIO_OUTPUT_ARGS = ['-vn', '-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', '24k']
+
+SILENCE_PATTERN = re.compile(r'silence_(start|end): (-?[\d.]+)')
+
+def _run_ffmpeg(arguments, loglevel='error'):
+    """Run ffmpeg and return its stderr, where it writes both errors and filter reports"""
+    command = [FFMPEG_BIN, '-hide_banner', '-loglevel', loglevel, '-nostdin', '-y'] + arguments
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg failed: {e.stderr.decode('utf-8', errors='replace').strip()}") from None
+    return result.stderr.decode('utf-8', errors='replace')
+
+def extract_audio(source, destination):
+    """Keep only the audio track, as mono 16 kHz Opus with leading and trailing silence trimmed"""
+    # silenceremove only trims the start, so trim, reverse, trim again and reverse back;
+    # pauses inside the answer are kept because they matter for grading delivery
+    trim = f"silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD_DB}dB:start_silence=0.2"
+    _run_ffmpeg(['-i', source, '-af', f"{trim},areverse,{trim},areverse"] + AUDIO_OUTPUT_ARGS + [destination])
+    return destination
+
+def detect_silences(path):
+    """Return (start, end) seconds of every pause in an audio file"""
+    report = _run_ffmpeg(
+        ['-i', path, '-af', f"silencedetect=noise={SILENCE_THRESHOLD_DB}dB:d={SILENCE_MIN_SECONDS}", '-f', 'null', '-'],
+        loglevel='info')
+    silences, start = [], None
+    for kind, value in SILENCE_PATTERN.findall(report):
+        if kind == 'start':
+            start = max(0.0, float(value))
+        elif start is not None:
+            silences.append((start, float(value)))
+            start = None
+    return silences
+
+def probe_duration(path):
+    """Duration of a media file in seconds"""
+    result = subprocess.run(
+        [FFPROBE_BIN, '-v', 'error', '-show_entries', 'format=duration',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        check=True, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+    return float(result.stdout.decode('utf-8').strip() or 0)
+
+def plan_segments(duration, silences, target_seconds=MEDIA_SEGMENT_SECONDS):
+    """Split [0, duration] into spans of about target_seconds, cutting in the middle of the nearest pause"""
+    spans, start = [], 0.0
+    pause_midpoints = [(pause_start + pause_end) / 2 for pause_start, pause_end in silences]
+    while duration - start > target_seconds * 1.5:
+        target = start + target_seconds
+        # Prefer a pause within half a segment of the target; otherwise cut blind at the target
+        candidates = [m for m in pause_midpoints if start + target_seconds / 2 < m < target + target_seconds / 2]
+        cut = min(candidates, key=lambda m: abs(m - target)) if candidates else target
+        spans.append((start, cut))
+        start = cut
+    spans.append((start, None))
+    return spans
+
+def cut_audio_segment(source, destination, start, end=None):
+    """Write the audio between start and end seconds of a recording to destination, dropping any video"""
+    # Seeking after -i decodes from the top, which stays exact on MediaRecorder output that has no cues
+    arguments = ['-i', source, '-ss', f"{start:.2f}"]
+    if end is not None:
+        arguments += ['-to', f"{end:.2f}"]
+    _run_ffmpeg(arguments + AUDIO_OUTPUT_ARGS + [destination])
+    return destination
+
+def _build_prompt(previous_text):
+    """A disfluent lead-in keeps Whisper from silently dropping the fillers speech metrics count"""
+    if not previous_text:
+        return FILLER_PROMPT
+    return f"{FILLER_PROMPT} {previous_text[-(PROMPT_MAX_CHARS - len(FILLER_PROMPT) - 1):]}"
+
+def transcribe_file(path, prompt=None, offset=0.0):
+    """Transcribe an audio file with Whisper; returns {'text', 'words'} with word times shifted by offset"""
+    with open(path, 'rb') as audio_file:
+        transcript = llm_gateway.transcribe(
+            model='whisper-1',
+            file=audio_file,
+            prompt=_build_prompt(prompt),
+            response_format='verbose_json',
+            timestamp_granularities=['word'],
+            timeout=120
+        )
+    words = [
+        {'word': word.word, 'start': round(word.start + offset, 3), 'end': round(word.end + offset, 3)}
+        for word in (transcript.words or [])
+    ]
+    return {'text': transcript.text.strip(), 'words': words}
+
+def stitch_transcripts(transcripts):
+    """Join segment transcripts in order, skipping empty segments"""
+    transcripts = [t for t in transcripts if t and t['text'].strip()]
+    return {
+        'text': ' '.join(t['text'].strip() for t in transcripts),
+        'words': [word for t in transcripts for word in t['words']]
+    }
+
+def transcribe_media(source):
+    """Transcribe a whole recording: extract its audio, split long answers at pauses and transcribe in parallel"""
+    with tempfile.TemporaryDirectory(prefix='media_') as work_dir:
+        audio_path = extract_audio(source, os.path.join(work_dir, 'audio.ogg'))
+        duration = probe_duration(audio_path)
+        if duration <= MEDIA_SEGMENT_SECONDS * 1.5:
+            return transcribe_file(audio_path)
+
+        spans = plan_segments(duration, detect_silences(audio_path))
+        segment_paths = [
+            cut_audio_segment(audio_path, os.path.join(work_dir, f"segment_{index}.ogg"), start, end)
+            for index, (start, end) in enumerate(spans)
+        ]
+        logger.info(f"Transcribing {duration:.0f}s answer as {len(spans)} parallel segments")
+        with ThreadPoolExecutor(max_workers=min(MEDIA_MAX_PARALLEL, len(spans))) as executor:
+            return stitch_transcripts(executor.map(
+                lambda path, span: transcribe_file(path, offset=span[0]), segment_paths, spans))
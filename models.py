@@ -1,7 +1,7 @@
 from extensions import db
 from datetime import datetime
 import json
-from sqlalchemy import Index
+from sqlalchemy import Index, UniqueConstraint
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -26,6 +26,10 @@ class User(UserMixin, db.Model):
     # Update the study_sessions relationship to avoid naming conflict
     study_sessions = db.relationship('StudySession', backref='student', lazy=True)
 
+    __table_args__ = (
+        Index('idx_user_created', 'created_at'),
+    )
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -82,6 +86,10 @@ class StudyPlan(db.Model):
                                    cascade='all, delete-orphan')
     # chat_history relationship is now handled by backref in ChatHistory model
 
+    __table_args__ = (
+        Index('idx_study_plan_user_created', 'user_id', 'created_at'),
+    )
+
     def get_content(self):
         """Get parsed content data"""
         try:
@@ -150,6 +158,40 @@ class Document(db.Model):
         except:
             return None
 
+class DocumentChunk(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
+    chunk_index = db.Column(db.Integer, nullable=False)  # Position within the document
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the chunk text
+    heading = db.Column(db.String(255))  # Section heading the chunk belongs to
+    content = db.Column(db.Text, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    document = db.relationship('Document', backref=db.backref(
+        'chunks', lazy=True, order_by='DocumentChunk.chunk_index', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        UniqueConstraint('document_id', 'content_hash', name='uq_document_chunk_hash'),
+        Index('idx_document_chunk_document_index', 'document_id', 'chunk_index'),
+    )
+
+# Extraction results shared across every upload of identical file bytes
+class ExtractionCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the file bytes
+    extractor_version = db.Column(db.String(20), nullable=False)
+    file_type = db.Column(db.String(50), nullable=False)
+    raw_text = db.Column(db.Text, nullable=False)
+    structured_content = db.Column(db.Text, nullable=False)  # JSON structured content
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_hit_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        UniqueConstraint('content_hash', 'extractor_version', name='uq_extraction_cache_hash_version'),
+    )
+
 class ChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -213,6 +255,41 @@ class InterviewQuestion(db.Model):
         Index('idx_interview_question_user_created', 'user_id', 'created_at'),
     )
 
+# Questions shared across users who paste the same or a near-identical job posting
+class QuestionBankPosting(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(64), unique=True, nullable=False)  # SHA-256 of the normalized posting
+    signature = db.Column(db.Text, nullable=False)  # JSON MinHash signature
+    job_description = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)  # Last time questions were added
+
+class QuestionBankBand(db.Model):
+    """One LSH band of a posting's signature; postings sharing any band are near-duplicate candidates"""
+    posting_id = db.Column(db.Integer, db.ForeignKey('question_bank_posting.id'), primary_key=True)
+    band_index = db.Column(db.Integer, primary_key=True)
+    band_hash = db.Column(db.String(16), nullable=False)
+
+    __table_args__ = (
+        Index('idx_question_bank_band_lookup', 'band_index', 'band_hash'),
+    )
+
+class QuestionBankQuestion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    posting_id = db.Column(db.Integer, db.ForeignKey('question_bank_posting.id'), nullable=False)
+    question_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the normalized question
+    question = db.Column(db.Text, nullable=False)
+    category = db.Column(db.String(50))
+    difficulty = db.Column(db.String(20))
+    served_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    posting = db.relationship('QuestionBankPosting', backref=db.backref('questions', lazy=True))
+
+    __table_args__ = (
+        UniqueConstraint('posting_id', 'question_hash', name='uq_question_bank_posting_question'),
+    )
+
 class InterviewPractice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -226,6 +303,7 @@ class InterviewPractice(db.Model):
     attempt_number = db.Column(db.Integer, default=1)  # Track multiple attempts
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     final_answer = db.Column(db.Boolean, default=False)  # Flag for final answer
+    status = db.Column(db.String(20), default='completed')  # pending, processing, completed, failed
 
     # Add relationships
     question = db.relationship('InterviewQuestion', backref='practices')
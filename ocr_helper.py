@@ -1,12 +1,143 @@
-import pytesseract
-from PIL import Image
+import os
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytesseract
+from PIL import Image, ImageOps
 
-def extract_text_from_image(image_path):
+# OCR settings: throughput via workers, memory via pixel and tile ceilings
+OCR_MAX_WORKERS = int(os.environ.get('OCR_MAX_WORKERS', os.cpu_count() or 2))
+OCR_MAX_PIXELS = int(os.environ.get('OCR_MAX_PIXELS', 16_000_000))
+OCR_MAX_WIDTH = int(os.environ.get('OCR_MAX_WIDTH', 1800))
+OCR_MIN_WIDTH = int(os.environ.get('OCR_MIN_WIDTH', 1000))
+OCR_TILE_HEIGHT = int(os.environ.get('OCR_TILE_HEIGHT', 2000))
+OCR_TARGET_DPI = int(os.environ.get('OCR_TARGET_DPI', 300))
+OCR_MAX_IN_FLIGHT = int(os.environ.get('OCR_MAX_IN_FLIGHT', 8))  # Images preprocessed per round
+
+_pool = None
+_pool_pid = None
+
+def _get_pool():
+    """Per-process OCR pool; daemonic workers (e.g. prefork celery) fall back to threads"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        if multiprocessing.current_process().daemon:
+            _pool = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix='ocr')
+        else:
+            _pool = ProcessPoolExecutor(max_workers=OCR_MAX_WORKERS)
+        _pool_pid = os.getpid()
+    return _pool
+
+def _reset_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+def _otsu_threshold(image):
+    """Global threshold that best separates text from background in a grayscale image"""
+    histogram = image.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background, weight_background = 0.0, 0
+    best_threshold, best_variance = 127, 0.0
+
+    for level, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += level * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+def preprocess_image(source):
+    """Load an image as grayscale, normalize its scale for OCR and binarize it"""
+    image = Image.open(source)
+    # Let JPEG decode at reduced size instead of materializing full-resolution pixels
+    if image.width > OCR_MAX_WIDTH:
+        image.draft('L', (OCR_MAX_WIDTH, int(image.height * OCR_MAX_WIDTH / image.width)))
+    image = ImageOps.exif_transpose(image).convert('L')
+
+    width, height = image.size
+    scale = 1.0
+    if width > OCR_MAX_WIDTH:
+        scale = OCR_MAX_WIDTH / width
+    elif width < OCR_MIN_WIDTH:
+        scale = min(OCR_MIN_WIDTH / width, 3.0)  # Small text reads better when enlarged
+    if width * height * scale * scale > OCR_MAX_PIXELS:
+        scale = (OCR_MAX_PIXELS / (width * height)) ** 0.5
+    if abs(scale - 1.0) > 0.05:
+        image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+    threshold = _otsu_threshold(image)
+    return image.point(lambda p: 255 if p > threshold else 0)
+
+def split_tiles(image):
+    """Cut tall images into tiles at the blankest row near each boundary to avoid splitting lines"""
+    width, height = image.size
+    if height <= OCR_TILE_HEIGHT * 1.5:
+        return [image]
+
+    tiles, top = [], 0
+    search = OCR_TILE_HEIGHT // 10
+    while height - top > OCR_TILE_HEIGHT * 1.5:
+        target = top + OCR_TILE_HEIGHT
+        band = image.crop((0, target - search, width, target + search))
+        # Average each row to one pixel; the brightest row is the emptiest
+        row_means = list(band.resize((1, band.height), Image.BOX).getdata())
+        cut = target - search + row_means.index(max(row_means))
+        tiles.append(image.crop((0, top, width, cut)))
+        top = cut
+    tiles.append(image.crop((0, top, width, height)))
+    return tiles
+
+def _ocr_tile(mode, size, data):
+    image = Image.frombytes(mode, size, data)
     try:
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image)
-        return text.strip()
+        return pytesseract.image_to_string(image, config=f'--dpi {OCR_TARGET_DPI}')
     except Exception as e:
-        logging.error(f"OCR error: {str(e)}")
-        return None
+        # pytesseract errors do not unpickle; a bad one would break the whole process pool
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+def extract_text_from_images(sources):
+    """OCR a batch of images (paths or file objects); returns one text or None per source"""
+    # Bound how many preprocessed images are held in memory at once
+    results = []
+    for start in range(0, len(sources), OCR_MAX_IN_FLIGHT):
+        results.extend(_extract_batch(sources[start:start + OCR_MAX_IN_FLIGHT]))
+    return results
+
+def _extract_batch(sources):
+    pool = _get_pool()
+    jobs = []
+    for source in sources:
+        try:
+            tiles = split_tiles(preprocess_image(source))
+            jobs.append([pool.submit(_ocr_tile, tile.mode, tile.size, tile.tobytes()) for tile in tiles])
+        except Exception as e:
+            logging.error(f"OCR preprocessing error: {str(e)}")
+            jobs.append(None)
+
+    results = []
+    for futures in jobs:
+        try:
+            results.append('\n'.join(f.result().strip() for f in futures).strip() if futures else None)
+        except BrokenProcessPool as e:
+            logging.error(f"OCR pool failed, recreating it: {str(e)}")
+            _reset_pool()
+            results.append(None)
+        except Exception as e:
+            logging.error(f"OCR error: {str(e)}")
+            results.append(None)
+    return results
+
+def extract_text_from_image(image_path):
+    return extract_text_from_images([image_path])[0]
@@ -0,0 +1,68 @@
+import json
+import base64
+from datetime import datetime
+from flask import request, jsonify, render_template
+from sqlalchemy import and_, or_
+
+# Page settings
+PAGE_SIZE = 20
+PAGE_SIZE_MAX = 100
+
+def encode_cursor(row):
+    """Opaque cursor pointing just past a row in (created_at, id) descending order"""
+    payload = json.dumps([row.created_at.isoformat(), row.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor") from None
+
+def keyset_page(query, model, cursor=None, limit=PAGE_SIZE, newest_first=True):
+    """Return (rows, next_cursor) for the page after cursor
+
+    Seeks on (created_at, id) instead of using OFFSET, so every page costs the same
+    index range scan no matter how deep it is. next_cursor is None on the last page.
+    """
+    if newest_first:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at.asc(), model.id.asc())
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        if newest_first:
+            query = query.filter(or_(
+                model.created_at < created_at,
+                and_(model.created_at == created_at, model.id < row_id)
+            ))
+        else:
+            query = query.filter(or_(
+                model.created_at > created_at,
+                and_(model.created_at == created_at, model.id > row_id)
+            ))
+
+    # One extra row says whether another page exists without a COUNT
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+def request_page(query, model, newest_first=True):
+    """keyset_page driven by the cursor and limit query parameters"""
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), PAGE_SIZE_MAX)
+    except ValueError:
+        limit = PAGE_SIZE
+    return keyset_page(query, model, request.args.get('cursor') or None, limit, newest_first)
+
+def page_response(rows, next_cursor, serialize, rows_template=None, **context):
+    """JSON page of items; with ?fragment=1 it also carries rows_template rendered for infinite scroll"""
+    payload = {'items': [serialize(row) for row in rows], 'next_cursor': next_cursor}
+    if rows_template and request.args.get('fragment'):
+        payload['html'] = render_template(rows_template, **context)
+    return jsonify(payload)
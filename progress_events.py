@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+from cache_helper import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Latest event per document or job, kept so a page that subscribes late can catch up
+STATE_TTL_SECONDS = 3600
+HEARTBEAT_SECONDS = 15
+# Streams hold a web worker connection, so each one ends after this long and the page reconnects
+STREAM_MAX_SECONDS = int(os.environ.get('PROGRESS_STREAM_MAX_SECONDS', 120))
+
+STAGES = ('extract', 'chunk', 'structure', 'index')
+
+def _channel(user_id, topic='document'):
+    return f"{topic}_progress:{user_id}"
+
+def _state_key(item_id, topic='document'):
+    return f"{topic}_progress:state:{item_id}"
+
+def _publish(topic, user_id, item_id, event):
+    try:
+        message = json.dumps(event)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.setex(_state_key(item_id, topic), STATE_TTL_SECONDS, message)
+        pipe.publish(_channel(user_id, topic), message)
+        pipe.execute()
+    except Exception as e:
+        # Progress is best effort; never fail a background job over it
+        logger.error(f"Progress publish error for {topic} {item_id}: {str(e)}")
+
+def publish(user_id, doc_id, stage, status, **extra):
+    """Announce a pipeline stage transition, e.g. publish(1, 7, 'chunk', 'completed')"""
+    _publish('document', user_id, doc_id,
+             {'doc_id': doc_id, 'stage': stage, 'status': status, 'at': time.time(), **extra})
+
+def publish_job(topic, user_id, job_id, status, **extra):
+    """Announce a background job's status, e.g. publish_job('practice', 1, 12, 'completed', feedback=...)"""
+    _publish(topic, user_id, job_id,
+             {'job_id': job_id, 'user_id': user_id, 'status': status, 'at': time.time(), **extra})
+
+def latest(item_ids, topic='document'):
+    """Return the last known event for each item that has one"""
+    if not item_ids:
+        return []
+    try:
+        values = redis_client.mget([_state_key(item_id, topic) for item_id in item_ids])
+        return [json.loads(value) for value in values if value]
+    except Exception as e:
+        logger.error(f"Progress state error: {str(e)}")
+        return []
+
+@contextmanager
+def subscription(user_id, topic='document'):
+    """Subscribe to a user's progress channel; read latest() inside the block so nothing slips between"""
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_channel(user_id, topic))
+    try:
+        yield pubsub
+    finally:
+        pubsub.close()
+
+def listen(pubsub, heartbeat=HEARTBEAT_SECONDS, max_seconds=STREAM_MAX_SECONDS):
+    """Yield events from a subscription as they arrive, and None as an idle heartbeat, for up to max_seconds"""
+    deadline = time.monotonic() + max_seconds
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        message = pubsub.get_message(timeout=min(heartbeat, remaining))
+        if message is None:
+            yield None
+        elif message['type'] == 'message':
+            yield json.loads(message['data'])
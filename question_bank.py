@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+from cache_helper import redis_client
+from models import QuestionBankPosting, QuestionBankBand, QuestionBankQuestion, db
+
+logger = logging.getLogger(__name__)
+
+# Bank settings, overridable per deployment
+QUESTION_BANK_SIMILARITY = float(os.environ.get('QUESTION_BANK_SIMILARITY', 0.7))  # Estimated Jaccard to share
+QUESTION_BANK_MAX_AGE_DAYS = int(os.environ.get('QUESTION_BANK_MAX_AGE_DAYS', 60))  # Older questions are retired
+QUESTION_BANK_REFRESH_DAYS = int(os.environ.get('QUESTION_BANK_REFRESH_DAYS', 7))  # Top up postings idle this long
+QUESTION_BANK_REPEAT_DAYS = int(os.environ.get('QUESTION_BANK_REPEAT_DAYS', 30))  # A user never sees a repeat sooner
+QUESTION_BANK_TOP_UP_SIZE = int(os.environ.get('QUESTION_BANK_TOP_UP_SIZE', 10))
+
+# 32 bands of 4 rows: postings around 0.4 similar become candidates, then the full signature decides
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32
+SHINGLE_WORDS = 3
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+# Fixed seed: signatures are stored, so the permutations must never change between processes
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+BankSample = namedtuple('BankSample', ['posting_id', 'questions', 'needs_top_up'])
+
+def normalize_text(text):
+    """Lowercase and keep only words, so formatting and punctuation differences don't matter"""
+    return ' '.join(re.findall(r"[a-z0-9+#]+", text.lower()))
+
+def fingerprint(text):
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+def minhash(text):
+    """MinHash signature over word shingles of a posting"""
+    words = normalize_text(text).split()
+    shingles = {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'big') for s in shingles),
+        dtype=np.uint64, count=len(shingles))
+    # a * x + b stays below 2**64 because a, b and x are all 32-bit
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0)
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(np.asarray(signature) == np.asarray(other)))
+
+def _band_hashes(signature):
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    return [hashlib.sha1(np.asarray(signature[i * rows:(i + 1) * rows], dtype=np.uint64).tobytes()).hexdigest()[:16]
+            for i in range(LSH_BANDS)]
+
+def find_posting(job_description, signature=None):
+    """The bank posting for this job description or a near-identical one, or None"""
+    posting = QuestionBankPosting.query.filter_by(fingerprint=fingerprint(job_description)).first()
+    if posting:
+        return posting
+
+    signature = minhash(job_description) if signature is None else signature
+    band_filter = db.or_(*(
+        db.and_(QuestionBankBand.band_index == index, QuestionBankBand.band_hash == band_hash)
+        for index, band_hash in enumerate(_band_hashes(signature))))
+    candidate_ids = db.session.query(QuestionBankBand.posting_id).filter(band_filter).distinct()
+    candidates = QuestionBankPosting.query.filter(QuestionBankPosting.id.in_(candidate_ids.scalar_subquery())).all()
+
+    scored = [(similarity(signature, json.loads(c.signature)), c) for c in candidates]
+    scored = [(score, c) for score, c in scored if score >= QUESTION_BANK_SIMILARITY]
+    return max(scored, key=lambda pair: pair[0])[1] if scored else None
+
+def get_or_create_posting(job_description):
+    signature = minhash(job_description)
+    posting = find_posting(job_description, signature)
+    if posting:
+        return posting
+
+    try:
+        posting = QuestionBankPosting(
+            fingerprint=fingerprint(job_description),
+            signature=json.dumps(signature.tolist()),
+            job_description=job_description[:2000]
+        )
+        db.session.add(posting)
+        db.session.flush()
+        db.session.add_all(QuestionBankBand(posting_id=posting.id, band_index=index, band_hash=band_hash)
+                           for index, band_hash in enumerate(_band_hashes(signature)))
+        db.session.commit()
+        return posting
+    except IntegrityError:
+        # Another request banked the same posting first
+        db.session.rollback()
+        return QuestionBankPosting.query.filter_by(fingerprint=fingerprint(job_description)).first()
+
+def add_questions(posting, questions):
+    """Bank generated questions under a posting, skipping ones it already has; returns the banked rows"""
+    existing = {row.question_hash: row for row in QuestionBankQuestion.query.filter_by(posting_id=posting.id)}
+    banked = []
+    for q in questions:
+        question_hash = fingerprint(q['question'])
+        if question_hash not in existing:
+            existing[question_hash] = QuestionBankQuestion(
+                posting_id=posting.id,
+                question_hash=question_hash,
+                question=q['question'],
+                category=q['category'],
+                difficulty=q['difficulty']
+            )
+            db.session.add(existing[question_hash])
+        banked.append(existing[question_hash])
+
+    posting.refreshed_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent top-up banked some of these; the next sample will see them
+        db.session.rollback()
+        return []
+    return banked
+
+def _seen_key(user_id, posting_id):
+    return f"question_bank:seen:{user_id}:{posting_id}"
+
+def seen_question_ids(user_id, posting_id):
+    try:
+        return {int(member) for member in redis_client.smembers(_seen_key(user_id, posting_id))}
+    except Exception as e:
+        logger.error(f"Question bank seen lookup error: {str(e)}")
+        return set()
+
+def mark_seen(user_id, posting_id, question_ids):
+    if not question_ids:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd(_seen_key(user_id, posting_id), *question_ids)
+        pipe.expire(_seen_key(user_id, posting_id), QUESTION_BANK_REPEAT_DAYS * 86400)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Question bank seen update error: {str(e)}")
+
+def sample(job_description, user_id, count=5):
+    """Pick up to count fresh banked questions this user hasn't seen, favouring the least served"""
+    posting = find_posting(job_description)
+    if not posting:
+        return BankSample(None, [], False)
+
+    fresh_after = datetime.utcnow() - timedelta(days=QUESTION_BANK_MAX_AGE_DAYS)
+    seen = seen_question_ids(user_id, posting.id)
+    pool = [q for q in QuestionBankQuestion.query.filter(
+        QuestionBankQuestion.posting_id == posting.id,
+        QuestionBankQuestion.created_at >= fresh_after
+    ).all() if q.id not in seen]
+
+    chosen = []
+    if len(pool) >= count:
+        weights = np.array([1.0 / (1 + (q.served_count or 0)) for q in pool])
+        picks = np.random.choice(len(pool), size=count, replace=False, p=weights / weights.sum())
+        chosen = [pool[i] for i in picks]
+        for q in chosen:
+            q.served_count = (q.served_count or 0) + 1
+        db.session.commit()
+        mark_seen(user_id, posting.id, [q.id for q in chosen])
+
+    # Top up before this user runs dry, and keep popular postings from going stale
+    stale = posting.refreshed_at is None or posting.refreshed_at < datetime.utcnow() - timedelta(days=QUESTION_BANK_REFRESH_DAYS)
+    needs_top_up = len(pool) - len(chosen) < count or stale
+    return BankSample(posting.id, [
+        {'question': q.question, 'category': q.category, 'difficulty': q.difficulty} for q in chosen
+    ], needs_top_up)
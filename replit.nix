@@ -2,6 +2,7 @@
   deps = [
     pkgs.redis
     pkgs.tesseract
+    pkgs.ffmpeg
     pkgs.postgresql
     pkgs.openssl
   ];
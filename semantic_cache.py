@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from llm_gateway import llm_gateway
+
+logger = logging.getLogger(__name__)
+
+# Cache settings, overridable per deployment
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.93))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get('SEMANTIC_CACHE_TTL_SECONDS', 86400))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', 5000))
+SEMANTIC_CACHE_VERIFY_RATE = float(os.environ.get('SEMANTIC_CACHE_VERIFY_RATE', 0.02))
+# Answers to the same question should embed at least this close to each other
+SEMANTIC_CACHE_ANSWER_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_ANSWER_THRESHOLD', 0.85))
+
+def normalize_prompt(text):
+    """Lowercase, collapse whitespace and strip trailing punctuation so trivial variants match"""
+    text = re.sub(r'\s+', ' ', text.strip().lower())
+    return text.strip(' ?!.')
+
+def context_fingerprint(messages):
+    """Stable fingerprint of everything but the user prompt (system prompt, tutor mode, context)"""
+    payload = json.dumps(messages, sort_keys=True).encode('utf-8')
+    return int.from_bytes(hashlib.sha256(payload).digest()[:8], 'big', signed=True)
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class SemanticCache:
+    """In-process nearest-neighbour cache of LLM answers keyed by prompt embedding"""
+
+    def __init__(self, embed_fn, threshold=SEMANTIC_CACHE_THRESHOLD, ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES, verify_rate=SEMANTIC_CACHE_VERIFY_RATE,
+                 answer_threshold=SEMANTIC_CACHE_ANSWER_THRESHOLD):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.verify_rate = verify_rate
+        self.answer_threshold = answer_threshold
+
+        # Row-aligned storage; the embedding matrix is allocated on first insert
+        self._matrix = None
+        self._fingerprints = np.zeros(max_entries, dtype=np.int64)
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._entries = [None] * max_entries
+        self._lru = OrderedDict()  # row -> None, least recently used first
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._verifier = ThreadPoolExecutor(max_workers=1, thread_name_prefix='semantic-cache-verify')
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self.verified = 0
+        self.false_hits = 0
+        self.false_hit_samples = deque(maxlen=50)
+
+    def lookup(self, prompt, fingerprint, regenerate_fn=None):
+        """Return (answer, embedding); answer is None on a miss and embedding is reused by store()"""
+        try:
+            embedding = _unit(self.embed_fn([normalize_prompt(prompt)])[0])
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup skipped: {e}")
+            return None, None
+
+        with self._lock:
+            row, similarity = self._nearest(embedding, fingerprint)
+            if row is None or similarity < self.threshold:
+                self.misses += 1
+                return None, embedding
+
+            entry = self._entries[row]
+            self._lru.move_to_end(row)
+            self.hits += 1
+            self.latency_saved += entry['latency']
+
+        logger.debug(f"Semantic cache hit (similarity={similarity:.3f}) for prompt: {prompt[:80]}")
+        if regenerate_fn and random.random() < self.verify_rate:
+            self._verifier.submit(self._verify_hit, prompt, entry, similarity, regenerate_fn)
+        return entry['answer'], embedding
+
+    def store(self, embedding, prompt, fingerprint, answer, latency):
+        """Insert an answer, evicting expired or least recently used rows when full"""
+        if embedding is None or not answer:
+            return
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+
+            row = self._allocate_row()
+            self._matrix[row] = embedding
+            self._fingerprints[row] = fingerprint
+            self._expires[row] = time.time() + self.ttl_seconds
+            self._entries[row] = {'prompt': prompt, 'answer': answer, 'latency': latency}
+            self._lru[row] = None
+
+    def stats(self):
+        """Counters for tuning the similarity threshold"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._lru),
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'latency_saved_seconds': round(self.latency_saved, 3),
+                'verified_hits': self.verified,
+                'false_hits': self.false_hits,
+                'false_hit_rate': self.false_hits / self.verified if self.verified else 0.0,
+                'false_hit_samples': list(self.false_hit_samples),
+            }
+
+    def _nearest(self, embedding, fingerprint):
+        if not self._lru:
+            return None, 0.0
+        rows = np.fromiter(self._lru.keys(), dtype=np.int64, count=len(self._lru))
+        valid = (self._fingerprints[rows] == fingerprint) & (self._expires[rows] > time.time())
+        rows = rows[valid]
+        if rows.size == 0:
+            return None, 0.0
+        similarities = self._matrix[rows] @ embedding
+        best = int(np.argmax(similarities))
+        return int(rows[best]), float(similarities[best])
+
+    def _allocate_row(self):
+        if not self._free_rows:
+            # Reclaim expired rows first, then fall back to least recently used
+            expired = [row for row in self._lru if self._expires[row] <= time.time()]
+            for row in expired or [next(iter(self._lru))]:
+                del self._lru[row]
+                self._entries[row] = None
+                self._free_rows.append(row)
+        return self._free_rows.pop()
+
+    def _verify_hit(self, prompt, entry, similarity, regenerate_fn):
+        """Regenerate a sampled hit and compare answers to estimate the false-hit rate"""
+        try:
+            fresh_answer = regenerate_fn()
+            cached_vec, fresh_vec = _unit(self.embed_fn([entry['answer'], fresh_answer]))
+            answer_similarity = float(cached_vec @ fresh_vec)
+            with self._lock:
+                self.verified += 1
+                if answer_similarity < self.answer_threshold:
+                    self.false_hits += 1
+                    self.false_hit_samples.append({
+                        'prompt': prompt,
+                        'cached_prompt': entry['prompt'],
+                        'prompt_similarity': round(similarity, 4),
+                        'answer_similarity': round(answer_similarity, 4),
+                    })
+        except Exception as e:
+            logger.warning(f"Semantic cache verification failed: {e}")
+
+# Shared cache for the process
+semantic_cache = SemanticCache(llm_gateway.embed)
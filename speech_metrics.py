@@ -0,0 +1,76 @@
+import re
+import numpy as np
+
+# Delivery targets for spoken interview answers
+IDEAL_WPM = (120.0, 160.0)
+PAUSE_MIN_SECONDS = 0.5  # Shorter gaps are ordinary word spacing
+LONG_PAUSE_SECONDS = 2.0
+WINDOW_SECONDS = 15.0  # Pace is also measured per window to judge consistency
+
+FILLER_WORDS = np.array(['um', 'umm', 'uh', 'uhh', 'er', 'erm', 'ah', 'hmm', 'mm', 'like', 'basically', 'actually'])
+FILLER_BIGRAMS = {('you', 'know'), ('i', 'mean'), ('sort', 'of'), ('kind', 'of')}
+
+# How much each component contributes to the 0-100 confidence score
+SCORE_WEIGHTS = {'pace': 0.35, 'fillers': 0.25, 'pauses': 0.25, 'consistency': 0.15}
+
+WORD_PATTERN = re.compile(r"[^a-z']+")
+
+def _band_score(value, low, high, falloff):
+    """1.0 inside [low, high], falling linearly to 0 over falloff outside it"""
+    distance = max(low - value, value - high, 0.0)
+    return max(0.0, 1.0 - distance / falloff)
+
+def compute_metrics(words):
+    """Delivery metrics from Whisper word timestamps: [{'word', 'start', 'end'}, ...] in seconds"""
+    if len(words) < 2:
+        return None
+
+    starts = np.fromiter((w['start'] for w in words), dtype=np.float64, count=len(words))
+    ends = np.fromiter((w['end'] for w in words), dtype=np.float64, count=len(words))
+    tokens = np.array([WORD_PATTERN.sub('', w['word'].lower()) for w in words])
+
+    duration = float(ends[-1] - starts[0])
+    if duration <= 0:
+        return None
+    word_count = int(np.count_nonzero(tokens))
+
+    gaps = np.clip(starts[1:] - ends[:-1], 0.0, None)
+    pauses = gaps[gaps >= PAUSE_MIN_SECONDS]
+
+    filler_mask = np.isin(tokens, FILLER_WORDS)
+    bigram_count = sum(1 for pair in zip(tokens[:-1], tokens[1:]) if pair in FILLER_BIGRAMS)
+    filler_count = int(filler_mask.sum()) + bigram_count
+
+    # Words per minute in fixed windows, ignoring a trailing window too short to say much
+    window_index = ((starts - starts[0]) // WINDOW_SECONDS).astype(np.int64)
+    window_counts = np.bincount(window_index)
+    full_windows = window_counts[:-1] if len(window_counts) > 1 else window_counts
+    window_wpm = full_windows * (60.0 / WINDOW_SECONDS)
+
+    metrics = {
+        'duration_seconds': round(duration, 2),
+        'word_count': word_count,
+        'words_per_minute': round(word_count / duration * 60.0, 1),
+        'pace_variation': round(float(window_wpm.std() / window_wpm.mean()), 3) if window_wpm.mean() else 0.0,
+        'pause_count': int(pauses.size),
+        'long_pause_count': int(np.count_nonzero(pauses >= LONG_PAUSE_SECONDS)),
+        'pause_ratio': round(float(pauses.sum() / duration), 3),
+        'mean_pause_seconds': round(float(pauses.mean()), 2) if pauses.size else 0.0,
+        'p90_pause_seconds': round(float(np.percentile(pauses, 90)), 2) if pauses.size else 0.0,
+        'filler_count': filler_count,
+        'filler_rate': round(filler_count / max(word_count, 1) * 100.0, 2),  # Per 100 words
+    }
+    metrics['confidence_score'] = score(metrics)
+    return metrics
+
+def score(metrics):
+    """Deterministic 0-100 delivery score from compute_metrics output"""
+    components = {
+        'pace': _band_score(metrics['words_per_minute'], *IDEAL_WPM, falloff=60.0),
+        # A couple of fillers per 100 words is natural speech
+        'fillers': _band_score(metrics['filler_rate'], 0.0, 2.0, falloff=8.0),
+        'pauses': _band_score(metrics['pause_ratio'], 0.05, 0.25, falloff=0.35)
+                  * (0.9 ** min(metrics['long_pause_count'], 10)),
+        'consistency': _band_score(metrics['pace_variation'], 0.0, 0.2, falloff=0.6),
+    }
+    return round(100.0 * sum(SCORE_WEIGHTS[name] * value for name, value in components.items()), 1)
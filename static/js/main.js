@@ -1,46 +1,49 @@
 document.addEventListener('DOMContentLoaded', () => {
     feather.replace();
 
-    // File upload handling
+    // File upload handling: files go up in resumable chunks, then /upload turns them into documents
     const uploadForm = document.getElementById('uploadForm');
     if (uploadForm) {
         uploadForm.addEventListener('submit', async (e) => {
             e.preventDefault();
-            const formData = new FormData();
-
-            // Add files
+            const csrfToken = uploadForm.querySelector('input[name="csrf_token"]').value;
             const fileInput = document.getElementById('files');
-            console.log('Selected files:', fileInput.files);
-            Array.from(fileInput.files).forEach(file => {
-                formData.append('files', file);
-                console.log('Appending file:', file.name);
-            });
-
-            // Add link if present
             const linkInput = document.getElementById('link');
-            if (linkInput.value) {
-                formData.append('link', linkInput.value);
-                console.log('Appending link:', linkInput.value);
-            }
+            const files = Array.from(fileInput.files);
 
             const progressBar = document.getElementById('uploadProgress');
             const progressBarInner = progressBar.querySelector('.progress-bar');
+            const totalBytes = files.reduce((sum, file) => sum + file.size, 0);
+            let doneBytes = 0;
 
             try {
                 progressBar.style.display = 'block';
                 progressBarInner.style.width = '0%';
 
-                console.log('Sending upload request...');
+                const formData = new FormData();
+                for (const file of files) {
+                    const uploadId = await uploadResumable(file, csrfToken, (bytes) => {
+                        const percent = totalBytes ? ((doneBytes + bytes) / totalBytes) * 100 : 100;
+                        progressBarInner.style.width = `${percent}%`;
+                    });
+                    doneBytes += file.size;
+                    formData.append('upload_ids', uploadId);
+                }
+                if (linkInput.value) {
+                    formData.append('link', linkInput.value);
+                }
+
                 const response = await fetch('/upload', {
                     method: 'POST',
+                    headers: { 'X-CSRFToken': csrfToken },
                     body: formData
                 });
 
                 progressBarInner.style.width = '100%';
                 const result = await response.json();
-                console.log('Upload response:', result);
 
                 if (result.success) {
+                    files.forEach(file => localStorage.removeItem(uploadKey(file)));
                     alert('Files uploaded successfully!');
                     location.reload();
                 } else {
@@ -48,7 +51,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
             } catch (error) {
                 console.error('Upload error:', error);
-                alert('Upload failed. Please try again.');
+                alert('Upload failed. Submit again to resume where it stopped.');
             } finally {
                 progressBar.style.display = 'none';
             }
@@ -129,4 +132,63 @@ function addMessage(type, content) {
     const chatMessages = document.getElementById('chat-messages');
     chatMessages.appendChild(messageDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
-}
\ No newline at end of file
+}
+
+function uploadKey(file) {
+    return `upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function uploadResumable(file, csrfToken, onProgress) {
+    // Resume an upload interrupted earlier (even across page loads) from the server's offset
+    let uploadId = localStorage.getItem(uploadKey(file));
+    let offset = 0;
+    let chunkSize;
+
+    if (uploadId) {
+        const status = await fetch(`/uploads/${uploadId}`);
+        if (status.ok) {
+            const result = await status.json();
+            offset = result.offset;
+            chunkSize = result.chunk_size;
+        } else {
+            uploadId = null;
+        }
+    }
+
+    if (!uploadId) {
+        const response = await fetch('/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        const result = await response.json();
+        if (!response.ok) throw new Error(result.error);
+        uploadId = result.upload_id;
+        chunkSize = result.chunk_size;
+        localStorage.setItem(uploadKey(file), uploadId);
+    }
+
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(`/uploads/${uploadId}`, {
+                method: 'PUT',
+                headers: { 'Upload-Offset': String(offset), 'X-CSRFToken': csrfToken },
+                body: file.slice(offset, offset + chunkSize)
+            });
+            const result = await response.json();
+            if (response.status === 409) {
+                offset = result.offset;  // Server holds a different amount; continue from there
+                continue;
+            }
+            if (!response.ok) throw new Error(result.error);
+            offset = result.offset;
+            failures = 0;
+            onProgress(offset);
+        } catch (error) {
+            if (++failures > 3) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+        }
+    }
+    return uploadId;
+}
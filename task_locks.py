@@ -0,0 +1,57 @@
+import time
+import uuid
+import logging
+from cache_helper import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Delete or extend a lock only while it still holds our token, so an expired
+# holder can never release a lock that another worker has since acquired
+_RELEASE_SCRIPT = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+_EXTEND_SCRIPT = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+def _lock_key(name):
+    return f"lock:{name}"
+
+def acquire(name, ttl_seconds):
+    """Take a lock with SET NX EX; returns its token, or None if someone else holds it"""
+    token = uuid.uuid4().hex
+    if redis_client.set(_lock_key(name), token, nx=True, ex=ttl_seconds):
+        return token
+    return None
+
+def release(name, token):
+    """Release a lock if the token still owns it; returns whether it did"""
+    try:
+        return bool(_RELEASE_SCRIPT(keys=[_lock_key(name)], args=[token]))
+    except Exception as e:
+        logger.error(f"Lock release error for {name}: {str(e)}")
+        return False
+
+def owns(name, token, ttl_seconds=None):
+    """Check a lock is still ours, optionally pushing its expiry out again"""
+    if ttl_seconds:
+        return bool(_EXTEND_SCRIPT(keys=[_lock_key(name)], args=[token, ttl_seconds]))
+    value = redis_client.get(_lock_key(name))
+    return value is not None and value.decode('utf-8') == token
+
+def wait_for(fetch, timeout_seconds, interval_seconds=0.5):
+    """Poll fetch() until it returns something other than None or the timeout passes"""
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        result = fetch()
+        if result is not None:
+            return result
+        time.sleep(interval_seconds)
+    return None
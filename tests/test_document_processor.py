@@ -0,0 +1,42 @@
+import os
+import sys
+
+# extensions.py configures the app from the environment at import time
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_processor import DocumentProcessor, HEADING_MAX_CHARS
+from llm_gateway import count_tokens
+
+TABLE_OF_CONTENTS = '\n'.join(
+    ['TABLE OF CONTENTS'] +
+    [f"CHAPTER {n} {name}" for n, name in enumerate(
+        ['INTRODUCTION', 'BACKGROUND', 'METHODS', 'RESULTS', 'DISCUSSION', 'LIMITATIONS',
+         'FUTURE WORK', 'CONCLUSION', 'REFERENCES', 'APPENDIX A', 'APPENDIX B', 'INDEX'], start=1)] +
+    ['', 'CHAPTER 1 INTRODUCTION'] +
+    [' '.join(f"Sentence {i} explains part {j} of the introduction." for j in range(12)) + '\n'
+     for i in range(20)]
+)
+
+def test_table_of_contents_does_not_build_one_long_heading():
+    chunks = DocumentProcessor().chunk_text(TABLE_OF_CONTENTS, max_tokens=400)
+
+    assert chunks
+    for chunk in chunks:
+        assert len(chunk['heading']) <= HEADING_MAX_CHARS
+        assert chunk['heading'].count(' - ') <= 1
+    assert chunks[-1]['heading'] == 'CHAPTER 12 INDEX - CHAPTER 1 INTRODUCTION'
+
+def test_chunks_never_exceed_max_tokens():
+    for max_tokens in (60, 150, 400):
+        for chunk in DocumentProcessor().chunk_text(TABLE_OF_CONTENTS, max_tokens=max_tokens):
+            assert count_tokens(chunk['content']) <= max_tokens
+            assert chunk['token_count'] == count_tokens(chunk['content'])
+
+def test_numeric_lines_and_numbered_lists_are_not_headings():
+    text = "Overview:\nIntro text.\n\n12\n\nSteps:\n1. Install the tool\n2. Run it\n"
+    sections = list(DocumentProcessor()._split_sections(text))
+
+    assert [heading for heading, _ in sections] == ['Overview', 'Steps']
+    assert sections[0][1] == ['Intro text.', '12']
@@ -0,0 +1,184 @@
+import os
+import json
+import fcntl
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from llm_gateway import llm_gateway, count_tokens
+from cache_helper import invalidate_user_data
+
+logger = logging.getLogger(__name__)
+
+# Index settings, overridable per deployment
+VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', os.path.join('instance', 'vector_index'))
+VECTOR_MIN_SCORE = float(os.environ.get('VECTOR_MIN_SCORE', 0.2))
+VECTOR_INDEX_CACHE_USERS = int(os.environ.get('VECTOR_INDEX_CACHE_USERS', 32))
+EMBED_BATCH_SIZE = 64
+
+# Per-process LRU of loaded indexes: user_id -> (mtime, vectors, entries)
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+
+def _index_path(user_id):
+    return os.path.join(VECTOR_INDEX_DIR, str(user_id), 'index.npz')
+
+def _embed(texts):
+    """Embed texts in batches and return a unit-normalized float32 matrix"""
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        vectors.extend(llm_gateway.embed(texts[start:start + EMBED_BATCH_SIZE]))
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def _load(user_id):
+    """Return (vectors, entries) for a user, reloading only when the file changed on disk"""
+    path = _index_path(user_id)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None, []
+
+    with _loaded_lock:
+        cached = _loaded.get(user_id)
+        if cached and cached[0] == mtime:
+            _loaded.move_to_end(user_id)
+            return cached[1], cached[2]
+
+    with np.load(path) as data:
+        vectors = data['vectors'].astype(np.float32, copy=False)
+        entries = json.loads(str(data['entries']))
+
+    with _loaded_lock:
+        _loaded[user_id] = (mtime, vectors, entries)
+        _loaded.move_to_end(user_id)
+        while len(_loaded) > VECTOR_INDEX_CACHE_USERS:
+            _loaded.popitem(last=False)
+    return vectors, entries
+
+def _update(user_id, sources):
+    """Replace every entry for each source with its new chunks in one write; [] removes the source"""
+    path = _index_path(user_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    chunks = [dict(chunk, source=source) for source, source_chunks in sources.items() for chunk in source_chunks]
+    new_vectors = _embed([chunk['text'] for chunk in chunks]) if chunks else None
+
+    # Serialize writers across gunicorn and celery processes
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        vectors, entries = _load(user_id)
+
+        keep = [i for i, entry in enumerate(entries) if entry['source'] not in sources]
+        entries = [entries[i] for i in keep]
+        vectors = vectors[keep] if vectors is not None else None
+
+        if new_vectors is not None:
+            entries.extend(chunks)
+            vectors = new_vectors if vectors is None or not len(vectors) else np.vstack([vectors, new_vectors])
+
+        if vectors is None:
+            # Still written when empty, so search knows this user has been backfilled
+            vectors = np.zeros((0, 0), dtype=np.float32)
+
+        # Write to a temp file and swap it in so readers never see a partial index
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, vectors=vectors, entries=np.array(json.dumps(entries)))
+        os.replace(tmp_path, path)
+
+    # Cached context for this user was built from the old index
+    invalidate_user_data(user_id)
+
+def document_chunks(document):
+    """Collect retrievable chunks for a processed document: summary, key concepts and source chunks"""
+    content = document.get_structured_content()
+    if not content:
+        return []
+
+    title = content.get('title', document.original_filename)
+    chunks = []
+    if content.get('summary'):
+        chunks.append({'title': title, 'text': content['summary']})
+
+    # Generated sections only stand in for the source text when no chunks were persisted
+    sections = [] if document.chunks else content.get('sections', [])
+    for section in sections:
+        parts = [section.get('heading', ''), section.get('content', '')]
+        parts.extend(section.get('key_points', []))
+        text = '\n'.join(part for part in parts if part)
+        if text:
+            chunks.append({'title': f"{title} - {section.get('heading', '')}".strip(' -'), 'text': text})
+
+    concepts = [f"{c.get('name', '')}: {c.get('description', '')}" for c in content.get('key_concepts', [])]
+    if concepts:
+        chunks.append({'title': f"{title} - Key concepts", 'text': '\n'.join(concepts)})
+
+    for chunk in chunks:
+        chunk.update(type='document', tokens=count_tokens(chunk['text']))
+
+    # Source-text chunks persisted at processing time; their token counts are already known
+    for chunk in document.chunks:
+        chunks.append({
+            'title': f"{title} - {chunk.heading}" if chunk.heading else title,
+            'text': chunk.content,
+            'type': 'document',
+            'tokens': chunk.token_count
+        })
+    return chunks
+
+def study_plan_chunks(plan):
+    """Split a study plan's content into retrievable chunks"""
+    content = plan.get_content()
+    if not content:
+        return []
+
+    chunks = []
+    if content.get('summary'):
+        chunks.append({'title': plan.title, 'text': content['summary']})
+
+    for concept in content.get('key_concepts', []):
+        text = f"{concept.get('name', '')}: {concept.get('description', '')}"
+        chunks.append({'title': f"{plan.title} - {concept.get('name', '')}", 'text': text})
+
+    for chunk in chunks:
+        chunk.update(type='study_plan', tokens=count_tokens(chunk['text']))
+    return chunks
+
+def index_document(document):
+    """Add or refresh a processed document in its owner's index"""
+    _update(document.user_id, {f"document:{document.id}": document_chunks(document)})
+
+def index_study_plan(plan):
+    """Add or refresh a study plan in its owner's index"""
+    _update(plan.user_id, {f"study_plan:{plan.id}": study_plan_chunks(plan)})
+
+def remove_source(user_id, source):
+    """Drop a deleted document or study plan, e.g. remove_source(1, 'study_plan:42')"""
+    if os.path.exists(_index_path(user_id)):
+        _update(user_id, {source: []})
+
+def build_user_index(user_id):
+    """Backfill the index from the database for users indexed before it existed"""
+    from models import Document, StudyPlan
+    sources = {f"document:{document.id}": document_chunks(document)
+               for document in Document.query.filter_by(user_id=user_id, processed=True).all()}
+    sources.update((f"study_plan:{plan.id}", study_plan_chunks(plan))
+                   for plan in StudyPlan.query.filter_by(user_id=user_id).all())
+    # One write for everything; also written when empty so search stops backfilling on every query
+    _update(user_id, sources)
+
+def search(user_id, query, top_k=8, min_score=VECTOR_MIN_SCORE):
+    """Return the top_k chunks most similar to the query, best first"""
+    if not os.path.exists(_index_path(user_id)):
+        build_user_index(user_id)
+
+    vectors, entries = _load(user_id)
+    if vectors is None or not len(entries):
+        return []
+
+    scores = vectors @ _embed([query])[0]
+    k = min(top_k, len(entries))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [dict(entries[i], score=float(scores[i])) for i in best if scores[i] >= min_score]